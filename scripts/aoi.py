@@ -0,0 +1,75 @@
+import glob
+import json
+import os
+import re
+
+from shapely.geometry import MultiPoint, shape, Polygon
+from shapely.ops import unary_union
+
+FOOTPRINT_PATTERN = re.compile(r"<gml:coordinates>([^<]+)</gml:coordinates>")
+GRID_POINT_PATTERN = re.compile(r"<latitude>([^<]+)</latitude>\s*<longitude>([^<]+)</longitude>")
+
+
+def feature_id(feature, index):
+    """Return a stable identifier for a GeoJSON feature."""
+    props = feature.get("properties") or {}
+    for key in ("id", "name", "aoi_id"):
+        if props.get(key) not in (None, ""):
+            return str(props[key])
+    if feature.get("id") not in (None, ""):
+        return str(feature["id"])
+    return f"aoi_{index:04d}"
+
+
+def load_aois(path):
+    """Load every AOI in a GeoJSON file as a list of (aoi_id, geometry)."""
+    with open(path, 'r') as f:
+        geojson = json.load(f)
+
+    kind = geojson.get("type")
+    if kind == "FeatureCollection":
+        return [(feature_id(feat, i), shape(feat["geometry"]))
+                for i, feat in enumerate(geojson["features"])]
+    if kind == "Feature":
+        return [(feature_id(geojson, 0), shape(geojson["geometry"]))]
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return [(name, shape(geojson))]
+
+
+def safe_footprint(safe_dir):
+    """Read the scene footprint polygon from a SAFE manifest."""
+    with open(os.path.join(safe_dir, "manifest.safe"), 'r') as f:
+        match = FOOTPRINT_PATTERN.search(f.read())
+    if not match:
+        raise ValueError(f"No footprint found in {safe_dir}/manifest.safe")
+
+    # Manifest coordinates are "lat,lon lat,lon ..."
+    points = []
+    for pair in match.group(1).split():
+        lat, lon = pair.split(",")
+        points.append((float(lon), float(lat)))
+    return Polygon(points)
+
+
+def subswath_footprint(safe_dir, subswath="IW2", polarisation="VV"):
+    """Footprint of one subswath, from its annotation's geolocation grid.
+
+    Returns None if the SAFE has no annotation for that subswath/polarisation.
+    """
+    pattern = f"s1?-{subswath.lower()}-slc-{polarisation.lower()}-*.xml"
+    matches = sorted(glob.glob(os.path.join(safe_dir, "annotation", pattern)))
+    if not matches:
+        return None
+    with open(matches[0], 'r') as f:
+        text = f.read()
+    grid = text[text.find("<geolocationGrid"):]
+    points = [(float(lon), float(lat)) for lat, lon in GRID_POINT_PATTERN.findall(grid)]
+    if len(points) < 3:
+        raise ValueError(f"No geolocation grid in {matches[0]}")
+    return MultiPoint(points).convex_hull
+
+
+def union_footprint(geoms):
+    """Union a list of geometries into a single footprint."""
+    return unary_union(list(geoms))
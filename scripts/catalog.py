@@ -0,0 +1,378 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+CATALOG_PATH = os.environ.get("INSAR_CATALOG", "/opt/data/catalog.sqlite")
+# Failed gpt runs a pair gets before it is left for manual inspection
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    scene_name      TEXT PRIMARY KEY,
+    file_name       TEXT,
+    platform        TEXT,
+    relative_orbit  INTEGER,
+    frame           INTEGER,
+    start_time      TEXT,
+    processing_date TEXT,
+    min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+    url             TEXT,
+    safe_path       TEXT,
+    added_at        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scenes_orbit_time ON scenes(relative_orbit, start_time);
+CREATE INDEX IF NOT EXISTS idx_scenes_time ON scenes(start_time);
+-- A B-tree cannot answer footprint overlap queries; drop it from older catalogs
+DROP INDEX IF EXISTS idx_scenes_bbox;
+
+CREATE TABLE IF NOT EXISTS pairs (
+    pair_id         TEXT PRIMARY KEY,
+    reference       TEXT NOT NULL REFERENCES scenes(scene_name),
+    secondary       TEXT NOT NULL REFERENCES scenes(scene_name),
+    relative_orbit  INTEGER,
+    status          TEXT NOT NULL DEFAULT 'planned',
+    aois            TEXT,
+    created_at      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pairs_orbit_status ON pairs(relative_orbit, status);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    pair_id         TEXT REFERENCES pairs(pair_id),
+    stage           TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    command         TEXT,
+    queued_at       TEXT,
+    started_at      TEXT,
+    finished_at     TEXT,
+    elapsed         REAL,
+    returncode      INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_stage_status ON jobs(stage, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_pair ON jobs(pair_id);
+
+CREATE TABLE IF NOT EXISTS products (
+    path            TEXT PRIMARY KEY,
+    pair_id         TEXT REFERENCES pairs(pair_id),
+    job_id          INTEGER REFERENCES jobs(job_id),
+    aoi_id          TEXT,
+    kind            TEXT,
+    size_bytes      INTEGER,
+    created_at      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_pair ON products(pair_id);
+
+CREATE TABLE IF NOT EXISTS watch_state (
+    key             TEXT PRIMARY KEY,
+    value           TEXT NOT NULL
+);
+"""
+
+
+def utcnow():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def geometry_bounds(geometry):
+    """Return (min_lon, min_lat, max_lon, max_lat) of a GeoJSON geometry dict."""
+    xs, ys = [], []
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for c in coords:
+                walk(c)
+
+    walk(geometry["coordinates"])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def scene_record(scene):
+    """Flatten an ASF search result into a scenes row."""
+    p = scene.properties
+    return (
+        p["sceneName"],
+        p.get("fileName"),
+        p.get("platform"),
+        p.get("relativeOrbit", p.get("pathNumber")),
+        p.get("frameNumber"),
+        p.get("startTime"),
+        p.get("processingDate"),
+        *geometry_bounds(scene.geometry),
+        p.get("url"),
+        utcnow(),
+    )
+
+
+class Catalog:
+    """Embedded SQLite catalog of scenes, pairs, gpt jobs and output products.
+
+    Every write method takes a batch and commits it in one transaction.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets the pipeline and snap containers read while the other writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- scenes ---
+
+    def add_scenes(self, scenes):
+        """Insert or refresh ASF search results, keeping any known SAFE path."""
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO scenes (scene_name, file_name, platform, relative_orbit, frame,
+                                       start_time, processing_date, min_lon, min_lat, max_lon,
+                                       max_lat, url, added_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(scene_name) DO UPDATE SET
+                       processing_date = excluded.processing_date,
+                       url = excluded.url""",
+                [scene_record(s) for s in scenes],
+            )
+
+    def set_safe_paths(self, paths):
+        """Record extracted SAFE locations from a {scene_name: path} mapping."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE scenes SET safe_path = ? WHERE scene_name = ?",
+                [(path, name) for name, path in paths.items()],
+            )
+
+    def safe_paths(self, scene_names):
+        """Return {scene_name: safe_path} for the scenes already downloaded."""
+        names = list(scene_names)
+        if not names:
+            return {}
+        rows = self.conn.execute(
+            f"SELECT scene_name, safe_path FROM scenes WHERE safe_path IS NOT NULL "
+            f"AND scene_name IN ({','.join('?' * len(names))})",
+            names,
+        )
+        return {r["scene_name"]: r["safe_path"] for r in rows}
+
+    def known_scenes(self, scene_names):
+        """Return the subset of scene_names already in the catalog."""
+        names = list(scene_names)
+        if not names:
+            return set()
+        rows = self.conn.execute(
+            f"SELECT scene_name FROM scenes WHERE scene_name IN ({','.join('?' * len(names))})", names)
+        return {r["scene_name"] for r in rows}
+
+    def neighbours(self, relative_orbit, frame, start_time, n):
+        """The n acquisitions before and after start_time on the same orbit and frame."""
+        before = self.conn.execute(
+            """SELECT * FROM scenes WHERE relative_orbit = ? AND frame = ? AND start_time < ?
+               ORDER BY start_time DESC LIMIT ?""",
+            (relative_orbit, frame, start_time, n),
+        ).fetchall()
+        after = self.conn.execute(
+            """SELECT * FROM scenes WHERE relative_orbit = ? AND frame = ? AND start_time > ?
+               ORDER BY start_time LIMIT ?""",
+            (relative_orbit, frame, start_time, n),
+        ).fetchall()
+        return before[::-1] + after
+
+    def scenes_to_download(self, missing_only=True, aoi=None):
+        """Scenes referenced by planned pairs that have no SAFE path yet.
+
+        With missing_only=False, scenes that already have one are included
+        too, so callers can check what is on disk covers their request.
+        With aoi, only pairs planned for that AOI count.
+        """
+        sql = ("SELECT DISTINCT s.* FROM scenes s "
+               "JOIN pairs p ON s.scene_name IN (p.reference, p.secondary) "
+               "WHERE p.status = 'planned'")
+        params = []
+        if missing_only:
+            sql += " AND s.safe_path IS NULL"
+        if aoi is not None:
+            sql += " AND EXISTS (SELECT 1 FROM json_each(p.aois) WHERE value = ?)"
+            params.append(aoi)
+        return self.conn.execute(sql + " ORDER BY s.start_time", params).fetchall()
+
+    # --- pairs ---
+
+    def add_pairs(self, pairs):
+        """Plan pairs given as dicts with pair_id, reference, secondary, relative_orbit, aois.
+
+        A pair that is already planned gains the new AOIs; its existing ones are kept.
+        """
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO pairs (pair_id, reference, secondary, relative_orbit, aois, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(pair_id) DO UPDATE SET aois = (
+                       SELECT json_group_array(value) FROM (
+                           SELECT value FROM json_each(pairs.aois)
+                           UNION SELECT value FROM json_each(excluded.aois)))""",
+                [(p["pair_id"], p["reference"], p["secondary"], p.get("relative_orbit"),
+                  json.dumps(p.get("aois", [])), utcnow()) for p in pairs],
+            )
+
+    def drop_pair_aois(self, pair_id, aois):
+        """Stop fanning a pair's outputs out to the given AOIs."""
+        with self.conn:
+            self.conn.execute(
+                """UPDATE pairs SET aois = (
+                       SELECT json_group_array(value) FROM json_each(pairs.aois)
+                       WHERE value NOT IN (SELECT value FROM json_each(?)))
+                   WHERE pair_id = ?""",
+                (json.dumps(list(aois)), pair_id),
+            )
+
+    def pair_ids(self, status, relative_orbit=None):
+        """Return the ids of pairs in a given status, optionally on one orbit."""
+        sql = "SELECT pair_id FROM pairs WHERE status = ?"
+        params = [status]
+        if relative_orbit is not None:
+            sql += " AND relative_orbit = ?"
+            params.append(relative_orbit)
+        return {r["pair_id"] for r in self.conn.execute(sql, params)}
+
+    def pending_pairs(self, max_attempts=MAX_ATTEMPTS, aoi=None):
+        """Planned pairs, and failed pairs with attempts left, whose scenes are both downloaded.
+
+        With aoi, only pairs planned for that AOI are returned.
+        """
+        sql = """SELECT p.pair_id, p.aois, r.safe_path AS in1, s.safe_path AS in2
+                 FROM pairs p
+                 JOIN scenes r ON r.scene_name = p.reference
+                 JOIN scenes s ON s.scene_name = p.secondary
+                 WHERE (p.status = 'planned'
+                        OR (p.status = 'failed' AND
+                            (SELECT COUNT(*) FROM jobs j
+                             WHERE j.pair_id = p.pair_id AND j.stage = 'gpt' AND j.status = 'failed') < ?))
+                   AND r.safe_path IS NOT NULL AND s.safe_path IS NOT NULL"""
+        params = [max_attempts]
+        if aoi is not None:
+            sql += " AND EXISTS (SELECT 1 FROM json_each(p.aois) WHERE value = ?)"
+            params.append(aoi)
+        return self.conn.execute(sql + " ORDER BY p.created_at", params).fetchall()
+
+    def find_pair(self, safe1, safe2):
+        """Return the id of the pair planned for two SAFE paths (either order), or None.
+
+        Scenes are matched by their recorded SAFE path or by the scene name
+        the SAFE directory is named after.
+        """
+        keys = []
+        for path in (safe1, safe2):
+            path = os.path.abspath(path.rstrip("/"))
+            keys.append((os.path.splitext(os.path.basename(path))[0], path))
+        (name1, path1), (name2, path2) = keys
+        row = self.conn.execute(
+            """SELECT p.pair_id FROM pairs p
+               JOIN scenes r ON r.scene_name = p.reference
+               JOIN scenes s ON s.scene_name = p.secondary
+               WHERE ((r.scene_name = ? OR r.safe_path = ?) AND (s.scene_name = ? OR s.safe_path = ?))
+                  OR ((r.scene_name = ? OR r.safe_path = ?) AND (s.scene_name = ? OR s.safe_path = ?))""",
+            (name1, path1, name2, path2, name2, path2, name1, path1),
+        ).fetchone()
+        return row["pair_id"] if row else None
+
+    def pair_status(self, pair_ids):
+        """Return {pair_id: status} for the given pairs."""
+        ids = list(pair_ids)
+        if not ids:
+            return {}
+        rows = self.conn.execute(
+            f"SELECT pair_id, status FROM pairs WHERE pair_id IN ({','.join('?' * len(ids))})", ids)
+        return {r["pair_id"]: r["status"] for r in rows}
+
+    # --- jobs ---
+
+    def start_job(self, pair_id, stage, command=None):
+        """Record a running job and return its id."""
+        now = utcnow()
+        with self.conn:
+            cur = self.conn.execute(
+                """INSERT INTO jobs (pair_id, stage, status, command, queued_at, started_at)
+                   VALUES (?, ?, 'running', ?, ?, ?)""",
+                (pair_id, stage, command, now, now),
+            )
+        return cur.lastrowid
+
+    def finish_job(self, job_id, returncode, elapsed, retry=False):
+        """Close a job and move its pair to processed/failed for gpt jobs.
+
+        With retry=True (the job never ran, e.g. gpt was not found) the job is
+        marked aborted and its pair goes back to planned without using an attempt.
+        """
+        if retry:
+            with self.conn:
+                self.conn.execute(
+                    """UPDATE jobs SET status = 'aborted', finished_at = ?, elapsed = ?, returncode = ?
+                       WHERE job_id = ?""",
+                    (utcnow(), elapsed, returncode, job_id),
+                )
+                self.conn.execute(
+                    """UPDATE pairs SET status = 'planned'
+                       WHERE pair_id = (SELECT pair_id FROM jobs WHERE job_id = ? AND stage = 'gpt')""",
+                    (job_id,),
+                )
+            return
+
+        status = "done" if returncode == 0 else "failed"
+        with self.conn:
+            self.conn.execute(
+                """UPDATE jobs SET status = ?, finished_at = ?, elapsed = ?, returncode = ?
+                   WHERE job_id = ?""",
+                (status, utcnow(), elapsed, returncode, job_id),
+            )
+            self.conn.execute(
+                """UPDATE pairs SET status = ?
+                   WHERE pair_id = (SELECT pair_id FROM jobs WHERE job_id = ? AND stage = 'gpt')""",
+                ("processed" if returncode == 0 else "failed", job_id),
+            )
+
+    # --- products ---
+
+    def add_products(self, products):
+        """Record output files given as dicts with path and optional pair_id, job_id, aoi_id, kind."""
+        rows = []
+        for p in products:
+            size = os.path.getsize(p["path"]) if os.path.isfile(p["path"]) else None
+            rows.append((p["path"], p.get("pair_id"), p.get("job_id"), p.get("aoi_id"),
+                         p.get("kind"), size, utcnow()))
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO products (path, pair_id, job_id, aoi_id, kind, size_bytes, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET
+                       job_id = excluded.job_id, size_bytes = excluded.size_bytes,
+                       created_at = excluded.created_at""",
+                rows,
+            )
+
+    # --- watch state ---
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM watch_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_state(self, values):
+        """Persist a {key: value} mapping of JSON-serialisable watch state."""
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO watch_state (key, value) VALUES (?, ?)
+                   ON CONFLICT(key) DO UPDATE SET value = excluded.value""",
+                [(k, json.dumps(v)) for k, v in values.items()],
+            )
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from shapely.geometry import mapping, shape
+
+from aoi import load_aois
+from catalog import Catalog, CATALOG_PATH
+from output_profiles import PROFILES, FALLBACK_PROFILE, creation_options, default_profile
+from utils import setup_logging, format_time
+
+# Rows read per pass when the source is stored in thin strips.
+MIN_STRIP_ROWS = 256
+
+
+class ClipTarget:
+    """One clipped output: its pixel window in the source and its open writer."""
+
+    def __init__(self, aoi_id, geom, window, out_path):
+        self.aoi_id = aoi_id
+        self.geom = geom
+        self.window = window
+        self.out_path = out_path
+        self.mask = None
+        self.dst = None
+
+    @property
+    def row_off(self):
+        return int(self.window.row_off)
+
+    @property
+    def row_end(self):
+        return int(self.window.row_off + self.window.height)
+
+    @property
+    def col_off(self):
+        return int(self.window.col_off)
+
+    @property
+    def col_end(self):
+        return int(self.window.col_off + self.window.width)
+
+
+def pixel_window(src, geom):
+    """Return the source pixel window covering geom, or None if outside the raster."""
+    minx, miny, maxx, maxy = geom.bounds
+    inv = ~src.transform
+    cols, rows = zip(*[inv * (x, y) for x, y in
+                       ((minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy))])
+    col0 = max(0, math.floor(min(cols)))
+    row0 = max(0, math.floor(min(rows)))
+    col1 = min(src.width, math.ceil(max(cols)))
+    row1 = min(src.height, math.ceil(max(rows)))
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def plan_targets(src, aois, out_dir, name, logger):
+    """Compute a ClipTarget for every AOI that intersects the source raster."""
+    targets = []
+    for aoi_id, geom in aois:
+        if src.crs is not None:
+            geom = shape(transform_geom("EPSG:4326", src.crs, mapping(geom)))
+        window = pixel_window(src, geom)
+        if window is None:
+            logger.warning(f"AOI {aoi_id} does not intersect {src.name}, skipping.")
+            continue
+        out_path = os.path.join(out_dir, aoi_id, name)
+        targets.append(ClipTarget(aoi_id, geom, window, out_path))
+    return targets
+
+
+def column_spans(targets, block_width, width):
+    """Group targets into disjoint, block-aligned column intervals.
+
+    Returns [(c0, c1, targets)]; targets whose block-aligned intervals
+    overlap or touch share one span, so each source block is read once.
+    """
+    spans = []
+    for t in sorted(targets, key=lambda t: t.col_off):
+        c0 = t.col_off - t.col_off % block_width
+        c1 = min(width, -(-t.col_end // block_width) * block_width)
+        if spans and c0 <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], c1)
+            spans[-1][2].append(t)
+        else:
+            spans.append([c0, c1, [t]])
+    return [tuple(span) for span in spans]
+
+
+def open_targets(src, targets, crop, profile_name):
+    """Open one writer per target and, when cropping, rasterize its polygon mask."""
+    driver, options = creation_options(profile_name, src.dtypes[0])
+    if driver != "GTiff":
+        # COG cannot be written window by window; keep the stream and use a tiled GeoTIFF
+        driver, options = creation_options(FALLBACK_PROFILE, src.dtypes[0])
+
+    nodata = src.nodata
+    if crop and nodata is None:
+        nodata = np.nan if np.issubdtype(np.dtype(src.dtypes[0]), np.floating) else 0
+
+    for t in targets:
+        t_transform = window_transform(t.window, src.transform)
+        profile = src.profile.copy()
+        for key in ("compress", "predictor"):
+            profile.pop(key, None)
+        profile.update(
+            driver=driver,
+            width=int(t.window.width),
+            height=int(t.window.height),
+            transform=t_transform,
+            nodata=nodata,
+            **options,
+        )
+        if crop:
+            # True inside the polygon; sized to the target, not the scene.
+            t.mask = geometry_mask([mapping(t.geom)], out_shape=(profile["height"], profile["width"]),
+                                   transform=t_transform, invert=True)
+        os.makedirs(os.path.dirname(t.out_path), exist_ok=True)
+        t.dst = rasterio.open(t.out_path, "w", **profile)
+    return nodata
+
+
+def clip_raster(src_path, aois, out_dir, name=None, crop=True, profile_name=FALLBACK_PROFILE, logger=None):
+    """Clip one raster to many AOIs in a single pass over the source.
+
+    The source is walked in row strips. Within a strip, the targets it
+    intersects are merged into disjoint block-aligned column spans; each
+    span is read once and every target takes its slice of that read, so
+    I/O follows the AOIs' area rather than their spread. Returns the list
+    of written paths.
+    """
+    if logger is None:
+        logger = setup_logging("clip_to_aoi")
+    name = name or os.path.basename(src_path)
+
+    with rasterio.open(src_path) as src:
+        targets = plan_targets(src, aois, out_dir, name, logger)
+        if not targets:
+            return []
+
+        nodata = open_targets(src, targets, crop, profile_name)
+        block_rows, block_cols = src.block_shapes[0]
+        strip_rows = max(block_rows, MIN_STRIP_ROWS)
+        row_start = min(t.row_off for t in targets)
+        row_stop = max(t.row_end for t in targets)
+        pixels_read = 0
+
+        try:
+            for r0 in range(row_start - row_start % strip_rows, row_stop, strip_rows):
+                r1 = min(r0 + strip_rows, src.height)
+                active = [t for t in targets if t.row_off < r1 and t.row_end > r0]
+                if not active:
+                    continue
+
+                for c0, c1, span_targets in column_spans(active, block_cols, src.width):
+                    lo = max(r0, min(t.row_off for t in span_targets))
+                    hi = min(r1, max(t.row_end for t in span_targets))
+                    strip = src.read(window=Window(c0, lo, c1 - c0, hi - lo))
+                    pixels_read += strip.shape[1] * strip.shape[2]
+
+                    for t in span_targets:
+                        tr0, tr1 = max(lo, t.row_off), min(hi, t.row_end)
+                        block = strip[:, tr0 - lo:tr1 - lo, t.col_off - c0:t.col_end - c0]
+                        if t.mask is not None:
+                            block = np.where(t.mask[tr0 - t.row_off:tr1 - t.row_off], block, nodata).astype(block.dtype, copy=False)
+                        t.dst.write(block, window=Window(0, tr0 - t.row_off, block.shape[2], block.shape[1]))
+        finally:
+            for t in targets:
+                t.dst.close()
+
+        logger.info(f"Read {pixels_read / (src.width * src.height):.1%} of {src_path} "
+                    f"for {len(targets)} target(s).")
+    return [t.out_path for t in targets]
+
+
+def main():
+    """
+    Clip SNAP outputs to one or many AOI polygons in a single pass per raster.
+    """
+    parser = argparse.ArgumentParser(description="Clip rasters to AOI polygons (one read per raster).")
+    parser.add_argument("aoi_geojson", help="Path to AOI GeoJSON (every feature becomes a target).")
+    parser.add_argument("rasters", nargs="*", help="Rasters to clip.")
+    parser.add_argument("--outdir", default="/opt/data/out/aoi", help="Output root; files go to <outdir>/<aoi_id>/.")
+    parser.add_argument("--pairs", help="Pair manifest (aoi_pairs.json); clips each pair product to its AOIs.")
+    parser.add_argument("--out", default="/opt/data/out", help="Processed pair root used with --pairs.")
+    parser.add_argument("--product", default="insar_filtered.tif", help="Product file name inside each pair folder.")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="SQLite catalog path.")
+    parser.add_argument("--profile", choices=list(PROFILES), default=default_profile(),
+                        help="Output encoding profile (default: last calibrated best).")
+    parser.add_argument("--bbox", action="store_true", help="Clip to the AOI bounding box without masking.")
+    args = parser.parse_args()
+
+    logger = setup_logging("clip_to_aoi")
+    aois = load_aois(args.aoi_geojson)
+    by_id = dict(aois)
+
+    # (source raster, AOIs to cut from it, output file name, pair id)
+    jobs = [(r, aois, None, None) for r in args.rasters]
+    if args.pairs:
+        with open(args.pairs, 'r') as f:
+            manifest = json.load(f)
+        for pair_id, p in manifest.items():
+            src_path = os.path.join(args.out, pair_id, args.product)
+            targets = [(a, by_id[a]) for a in p["aois"] if a in by_id]
+            jobs.append((src_path, targets, f"{pair_id}_{args.product}", pair_id))
+
+    if not jobs:
+        logger.error("Nothing to clip: pass rasters or --pairs.")
+        sys.exit(1)
+
+    start_time = time.time()
+    products = []
+    for src_path, targets, name, pair_id in jobs:
+        if not os.path.exists(src_path):
+            logger.warning(f"{src_path} not found, skipping.")
+            continue
+        try:
+            paths = clip_raster(src_path, targets, args.outdir, name, not args.bbox, args.profile, logger)
+        except Exception as e:
+            logger.error(f"Clipping {src_path} failed: {e}")
+            sys.exit(1)
+        products += [{"path": path, "pair_id": pair_id, "aoi_id": os.path.basename(os.path.dirname(path)),
+                      "kind": "clip"} for path in paths]
+
+    with Catalog(args.catalog) as catalog:
+        catalog.add_products(products)
+    logger.info(f"Wrote {len(products)} clipped product(s) in {format_time(time.time() - start_time)}.")
+
+
+if __name__ == "__main__":
+    main()
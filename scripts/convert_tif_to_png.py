@@ -4,13 +4,15 @@ import numpy as np
 import os
 import sys
 
+from generate_report import read_quicklook
+
 def convert_tif_to_png(tif_path, png_path):
     """
     Converts a GeoTIFF file to a PNG image.
     """
     with rasterio.open(tif_path) as src:
-        # Read the first band
-        arr = src.read(1)
+        # Read the first band, decimated (served from overviews when the file has them)
+        arr = read_quicklook(src)
         
         # Get metadata
         meta = src.meta
@@ -19,7 +21,7 @@ def convert_tif_to_png(tif_path, png_path):
         try:
             cmap = meta['colormap'][1]
             # Normalize the array to the colormap range
-            arr = np.interp(arr, (arr.min(), arr.max()), (0, 255)).astype(np.uint8)
+            arr = np.interp(arr, (np.nanmin(arr), np.nanmax(arr)), (0, 255)).astype(np.uint8)
         except (KeyError, IndexError):
             # Use a default colormap if one is not found in the metadata
             cmap = 'viridis'
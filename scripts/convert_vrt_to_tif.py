@@ -19,20 +19,77 @@
 
 
 
+import argparse
+import glob, os
+
+import numpy as np
 import rasterio
-import glob, os, sys
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from dimap_reader import DimapProduct
+from output_profiles import PROFILES, FALLBACK_PROFILE, creation_options, default_profile, write_with_profile
+
+def dim_to_tif(dim_path, out_tif, profile_name, rows=512):
+    """Write a BEAM-DIMAP product to GeoTIFF straight from its memory-mapped bands."""
+    product = DimapProduct(dim_path)
+    bands = list(product)
+    height, width = bands[0].shape
+    dtype = np.result_type(*[b.dtype.newbyteorder("=") for b in bands])
+
+    driver, opts = creation_options(profile_name, dtype)
+    target = out_tif
+    if driver != "GTiff":
+        # COG is copy-only: stream into a GeoTIFF first, then let GDAL lay it out
+        driver, opts = creation_options(FALLBACK_PROFILE, dtype)
+        target = out_tif + ".tmp.tif"
+
+    profile = dict(driver=driver, width=width, height=height, count=len(bands), dtype=dtype, **opts)
+    # GeoTIFF holds one nodata value per file; SNAP products use the same one for all bands
+    nodata = next((b.nodata for b in bands if b.nodata is not None), None)
+    if nodata is not None:
+        profile["nodata"] = nodata
+    if product.crs_wkt:
+        profile["crs"] = CRS.from_wkt(product.crs_wkt)
+    if product.geotransform:
+        profile["transform"] = Affine.from_gdal(*product.geotransform)
+
+    with rasterio.open(target, 'w', **profile) as dst:
+        # Raw values are kept; readers apply the band scaling from the metadata
+        dst.scales = [b.scaling[0] for b in bands]
+        dst.offsets = [b.scaling[1] for b in bands]
+        for k, band in enumerate(bands, start=1):
+            dst.set_band_description(k, band.name)
+        # All bands of a strip go out together, so no compressed tile is rewritten
+        for row_off in range(0, height, rows):
+            h = min(rows, height - row_off)
+            # SNAP writes big-endian; swap per block only when needed
+            block = np.stack([b.window(row_off, 0, h, width).astype(dtype, copy=False) for b in bands])
+            dst.write(block, window=Window(0, row_off, width, h))
+
+    if target != out_tif:
+        write_with_profile(target, out_tif, profile_name)
+        os.remove(target)
+    return out_tif
 
 if __name__ == "__main__":
-    outdir = sys.argv[1] if len(sys.argv)>1 else "/opt/data/out"
-    tiles = glob.glob(os.path.join(outdir, '*.vrt')) + glob.glob(os.path.join(outdir, '*.tif'))
+    parser = argparse.ArgumentParser(description="Convert VRT and BEAM-DIMAP outputs to GeoTIFF using an output profile.")
+    parser.add_argument("outdir", nargs="?", default="/opt/data/out", help="Directory containing *.vrt / *.dim outputs.")
+    parser.add_argument("--profile", choices=list(PROFILES), default=default_profile(),
+                        help="Output encoding profile (default: last calibrated best).")
+    args = parser.parse_args()
+
+    tiles = glob.glob(os.path.join(args.outdir, '*.vrt'))
     for t in tiles:
-        if t.endswith('.tif'):
+        if os.path.exists(t.replace('.vrt', '.dim')):
             continue
         out_tif = t.replace('.vrt', '.tif')
-        with rasterio.open(t) as src:
-            meta = src.meta.copy()
-            meta.update(driver='GTiff', compress='lzw')
-            data = src.read()
-            with rasterio.open(out_tif, 'w', **meta) as dst:
-                dst.write(data)
-        print("Saved", out_tif)
+        write_with_profile(t, out_tif, args.profile)
+        print("Saved", out_tif, f"(profile: {args.profile})")
+
+    # BEAM-DIMAP products are read natively, without an intermediate VRT
+    for d in glob.glob(os.path.join(args.outdir, '*.dim')):
+        out_tif = d.replace('.dim', '.tif')
+        dim_to_tif(d, out_tif, args.profile)
+        print("Saved", out_tif, f"(profile: {args.profile})")
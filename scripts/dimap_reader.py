@@ -0,0 +1,170 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# ENVI "data type" codes -> NumPy type characters
+ENVI_DTYPES = {
+    1: "u1", 2: "i2", 3: "i4", 4: "f4", 5: "f8", 6: "c8", 9: "c16",
+    12: "u2", 13: "u4", 14: "i8", 15: "u8",
+}
+
+
+def parse_envi_header(hdr_path):
+    """Parse an ENVI .hdr file into a dict of lower-cased keys."""
+    with open(hdr_path, 'r') as f:
+        text = f.read()
+    if not text.lstrip().startswith("ENVI"):
+        raise ValueError(f"{hdr_path} is not an ENVI header")
+
+    header = {}
+    # Values in braces may span several lines
+    for match in re.finditer(r"^\s*([^=\n]+?)\s*=\s*(\{[^}]*\}|[^\n]*)", text, re.MULTILINE):
+        key, value = match.group(1).strip().lower(), match.group(2).strip()
+        if value.startswith("{"):
+            value = value[1:-1].strip()
+        header[key] = value
+    return header
+
+
+def envi_dtype(header):
+    """NumPy dtype of an ENVI header, honouring its byte order."""
+    code = int(header["data type"])
+    if code not in ENVI_DTYPES:
+        raise ValueError(f"Unsupported ENVI data type {code}")
+    order = ">" if int(header.get("byte order", 0)) == 1 else "<"
+    return np.dtype(order + ENVI_DTYPES[code])
+
+
+def map_info_geotransform(map_info):
+    """GDAL-style geotransform from an ENVI 'map info' value, or None."""
+    parts = [p.strip() for p in map_info.split(",")]
+    try:
+        ref_x, ref_y, easting, northing, dx, dy = (float(v) for v in parts[1:7])
+    except (ValueError, IndexError):
+        return None
+    # ENVI reference pixels are 1-based
+    return (easting - (ref_x - 1) * dx, dx, 0.0, northing + (ref_y - 1) * dy, 0.0, -dy)
+
+
+class DimapBand:
+    """One BEAM-DIMAP band exposed as a read-only NumPy memmap."""
+
+    def __init__(self, name, img_path, header, unit=None, nodata=None, scaling=(1.0, 0.0)):
+        if header.get("interleave", "bsq").lower() != "bsq" or int(header.get("bands", 1)) != 1:
+            raise ValueError(f"{img_path}: only single-band BSQ images are supported")
+        self.name = name
+        self.path = img_path
+        self.header = header
+        self.unit = unit
+        self.nodata = nodata
+        self.scaling = scaling
+        self.dtype = envi_dtype(header)
+        self.shape = (int(header["lines"]), int(header["samples"]))
+        self.array = np.memmap(img_path, dtype=self.dtype, mode="r",
+                               offset=int(header.get("header offset", 0)), shape=self.shape)
+
+    def window(self, row_off, col_off, height, width):
+        """Return a view of a pixel window; no data is copied until it is used."""
+        return self.array[row_off:row_off + height, col_off:col_off + width]
+
+    def blocks(self, rows=512):
+        """Yield (row_off, view) strips covering the band."""
+        for row_off in range(0, self.shape[0], rows):
+            yield row_off, self.array[row_off:row_off + rows]
+
+
+class ComplexPair:
+    """The i_/q_ bands of a complex SNAP product, combined block by block.
+
+    SNAP stores i and q in separate files, so they cannot share one complex
+    buffer. Both inputs stay memory-mapped; each call allocates only its result.
+    """
+
+    def __init__(self, i_band, q_band):
+        if i_band.shape != q_band.shape:
+            raise ValueError(f"{i_band.name} and {q_band.name} differ in shape")
+        self.i = i_band
+        self.q = q_band
+        self.shape = i_band.shape
+
+    def window(self, row_off, col_off, height, width, dtype=np.complex64):
+        """Complex samples of a window, written straight into one output array."""
+        i = self.i.window(row_off, col_off, height, width)
+        q = self.q.window(row_off, col_off, height, width)
+        out = np.empty(i.shape, dtype=dtype)
+        out.real = i
+        out.imag = q
+        return out
+
+    def intensity(self, row_off, col_off, height, width):
+        i = self.i.window(row_off, col_off, height, width).astype(np.float32)
+        q = self.q.window(row_off, col_off, height, width)
+        i *= i
+        i += np.square(q, dtype=np.float32)
+        return i
+
+    def phase(self, row_off, col_off, height, width):
+        i = self.i.window(row_off, col_off, height, width)
+        q = self.q.window(row_off, col_off, height, width)
+        return np.arctan2(q, i, dtype=np.float32)
+
+
+class DimapProduct:
+    """Reader for a BEAM-DIMAP product (.dim + .data/*.img/.hdr)."""
+
+    def __init__(self, dim_path):
+        self.path = dim_path
+        self.data_dir = os.path.splitext(dim_path)[0] + ".data"
+        root = ET.parse(dim_path).getroot()
+
+        self.crs_wkt = (root.findtext("Coordinate_Reference_System/WKT") or "").strip() or None
+        self.geotransform = None
+        i2m = root.findtext("Geoposition/IMAGE_TO_MODEL_TRANSFORM")
+        if i2m:
+            # Java AffineTransform order: m00, m10, m01, m11, m02, m12
+            m00, m10, m01, m11, m02, m12 = (float(v) for v in i2m.split(","))
+            self.geotransform = (m02, m00, m01, m12, m10, m11)
+
+        files = {}
+        for data_file in root.iter("Data_File"):
+            index = int(data_file.findtext("BAND_INDEX"))
+            href = data_file.find("DATA_FILE_PATH").get("href")
+            files[index] = os.path.join(os.path.dirname(dim_path), href)
+
+        self.bands = {}
+        for info in root.iter("Spectral_Band_Info"):
+            index = int(info.findtext("BAND_INDEX"))
+            if index not in files:
+                # Virtual bands are expressions with no file on disk
+                continue
+            hdr_path = files[index]
+            header = parse_envi_header(hdr_path)
+            nodata = None
+            if (info.findtext("NO_DATA_VALUE_USED") or "").strip().lower() == "true":
+                nodata = float(info.findtext("NO_DATA_VALUE"))
+            scaling = (float(info.findtext("SCALING_FACTOR") or 1.0),
+                       float(info.findtext("SCALING_OFFSET") or 0.0))
+            name = info.findtext("BAND_NAME")
+            self.bands[name] = DimapBand(name, os.path.splitext(hdr_path)[0] + ".img", header,
+                                         info.findtext("PHYSICAL_UNIT"), nodata, scaling)
+
+        if self.geotransform is None and self.bands:
+            map_info = next(iter(self.bands.values())).header.get("map info")
+            if map_info:
+                self.geotransform = map_info_geotransform(map_info)
+
+    def __getitem__(self, name):
+        return self.bands[name]
+
+    def __iter__(self):
+        return iter(self.bands.values())
+
+    def complex_pairs(self):
+        """Return {suffix: ComplexPair} for every matching i_<suffix>/q_<suffix> band pair."""
+        pairs = {}
+        for name in self.bands:
+            if name.startswith("i_") and "q_" + name[2:] in self.bands:
+                pairs[name[2:]] = ComplexPair(self.bands[name], self.bands["q_" + name[2:]])
+        return pairs
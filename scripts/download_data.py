@@ -3,11 +3,21 @@ import os
 import sys
 import argparse
 from shapely.geometry import shape
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 import json
 from datetime import datetime
 import requests
 import zipfile
 
+from aoi import load_aois, safe_footprint, subswath_footprint
+from catalog import Catalog, CATALOG_PATH
+from remote_safe import fetch_partial_safe, mark_full, safe_covers
+
+# The subswath/polarisation insar_graph.xml's TOPSAR-Split keeps
+GRAPH_SUBSWATH = ("IW2", "VV")
+
 
 def get_relative_orbit(scene):
     """Extract relative orbit number safely."""
@@ -66,6 +76,159 @@ def select_best_pair(scenes, start_dt, end_dt):
     return [scene1, scene2]
 
 
+def parse_start_time(scene):
+    return datetime.strptime(scene.properties['startTime'], '%Y-%m-%dT%H:%M:%SZ')
+
+
+def safe_dir_for(scene, outdir):
+    """Path of the extracted SAFE directory for a scene."""
+    name = os.path.splitext(scene.properties["fileName"])[0]
+    return os.path.join(outdir, name + ".SAFE")
+
+
+def make_pair_id(scene1, scene2):
+    """Stable pair identifier: orbit, frame and both acquisition dates."""
+    orbit = int(get_relative_orbit(scene1))
+    frame = scene1.properties.get("frameNumber")
+    return (f"P{orbit:03d}_F{frame}_"
+            f"{parse_start_time(scene1):%Y%m%d}_{parse_start_time(scene2):%Y%m%d}")
+
+
+def pair_record(pair_id, scenes, aois=()):
+    """Catalog row for a planned pair."""
+    return {
+        "pair_id": pair_id,
+        "reference": scenes[0].properties["sceneName"],
+        "secondary": scenes[1].properties["sceneName"],
+        "relative_orbit": get_relative_orbit(scenes[0]),
+        "aois": list(aois),
+    }
+
+
+def group_search_footprints(aois, merge_distance=1.0):
+    """Group AOIs into the fewest search footprints.
+
+    AOIs closer than merge_distance (degrees) are merged into one cluster and
+    searched with the envelope of its members. Returns a list of
+    (footprint, [aoi_id, ...]).
+    """
+    clusters = unary_union([g.buffer(merge_distance / 2) for _, g in aois])
+    parts = list(getattr(clusters, "geoms", [clusters]))
+
+    groups = []
+    for part in parts:
+        prepared = prep(part)
+        members = [(aoi_id, g) for aoi_id, g in aois if prepared.intersects(g)]
+        footprint = unary_union([g for _, g in members]).envelope
+        groups.append((footprint, [aoi_id for aoi_id, _ in members]))
+    return groups
+
+
+def assign_scenes(aois, scenes):
+    """Assign scenes to each AOI, ranked by the fraction of the AOI they cover.
+
+    Returns {aoi_id: [(overlap_fraction, scene), ...]} sorted best first.
+    """
+    footprints = [shape(s.geometry) for s in scenes]
+    prepared = [prep(fp) for fp in footprints]
+    tree = STRtree(footprints)
+
+    assignments = {}
+    for aoi_id, geom in aois:
+        ranked = []
+        for idx in tree.query(geom):
+            if not prepared[idx].intersects(geom):
+                continue
+            if prepared[idx].covers(geom) or geom.area == 0:
+                fraction = 1.0
+            else:
+                fraction = footprints[idx].intersection(geom).area / geom.area
+            ranked.append((fraction, scenes[idx]))
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        assignments[aoi_id] = ranked
+    return assignments
+
+
+def plan_pairs(assignments, start_dt, end_dt, min_overlap=0.0):
+    """Pick one pair per AOI and merge AOIs that share the same pair.
+
+    Within the best orbit, only scenes of the frame covering the AOI best are
+    considered, so AOIs in the same frame resolve to the same pair.
+    Returns {pair_id: {"scenes": [s1, s2], "aois": [...]}}.
+    """
+    pairs = {}
+    for aoi_id, ranked in assignments.items():
+        candidates = [s for frac, s in ranked if frac >= min_overlap]
+        best_orbit = pick_best_orbit(candidates)
+        if best_orbit is None:
+            print(f"WARNING: No scenes cover AOI {aoi_id}, skipping.")
+            continue
+
+        frame_overlap = {}
+        for frac, s in ranked:
+            if frac >= min_overlap and get_relative_orbit(s) == best_orbit:
+                frame = s.properties.get("frameNumber")
+                frame_overlap[frame] = max(frame_overlap.get(frame, 0.0), frac)
+        best_frame = max(frame_overlap, key=frame_overlap.get)
+
+        same_frame = [s for s in candidates
+                      if get_relative_orbit(s) == best_orbit
+                      and s.properties.get("frameNumber") == best_frame]
+        if len(same_frame) < 2:
+            print(f"WARNING: Not enough scenes for AOI {aoi_id} on orbit {best_orbit}, skipping.")
+            continue
+
+        pair = sorted(select_best_pair(same_frame, start_dt, end_dt), key=parse_start_time)
+        if None in pair or pair[0] is pair[1]:
+            print(f"WARNING: Could not determine 2-scene pair for AOI {aoi_id}, skipping.")
+            continue
+
+        pair_id = make_pair_id(pair[0], pair[1])
+        entry = pairs.setdefault(pair_id, {"scenes": pair, "aois": []})
+        entry["aois"].append(aoi_id)
+    return pairs
+
+
+def processed_footprint(safe_dir, subswath, polarisation):
+    """Area of a SAFE the graph actually processes; the whole scene if unknown."""
+    footprint = subswath_footprint(safe_dir, subswath, polarisation)
+    return footprint if footprint is not None else safe_footprint(safe_dir)
+
+
+def restrict_to_subswath(pairs, aois, safe_paths, subswath, polarisation, min_overlap=0.0):
+    """Keep only the AOIs each pair's processed subswath can contain.
+
+    Scenes are assigned by whole-scene footprint, but only one subswath is
+    processed; an AOI is kept when the subswath area both scenes share
+    covers at least min_overlap of it. Pairs left without AOIs are dropped.
+    """
+    geoms = dict(aois)
+    kept = {}
+    for pair_id, p in pairs.items():
+        common = None
+        for scene in p["scenes"]:
+            footprint = processed_footprint(safe_paths[scene.properties["sceneName"]], subswath, polarisation)
+            common = footprint if common is None else common.intersection(footprint)
+        covered = []
+        for aoi_id in p["aois"]:
+            geom = geoms[aoi_id]
+            if not common.intersects(geom):
+                fraction = 0.0
+            elif geom.area == 0:
+                fraction = 1.0
+            else:
+                fraction = common.intersection(geom).area / geom.area
+            if fraction > 0 and fraction >= min_overlap:
+                covered.append(aoi_id)
+            else:
+                print(f"WARNING: {subswath}/{polarisation} of {pair_id} does not cover AOI {aoi_id}, dropping it.")
+        if covered:
+            kept[pair_id] = {**p, "aois": covered}
+        else:
+            print(f"WARNING: {pair_id} covers none of its AOIs in {subswath}, skipping.")
+    return kept
+
+
 def unzip_and_cleanup(zip_path, outdir):
     """Unzip SAFE and delete zip."""
     print(f"DEBUG: Unzipping {zip_path}...")
@@ -76,12 +239,145 @@ def unzip_and_cleanup(zip_path, outdir):
     print(f"DEBUG: Removed {zip_path}")
 
 
+def search_scenes(geom, start_iso, end_iso):
+    """Search Sentinel-1 IW SLC scenes intersecting geom."""
+    return asf.geo_search(
+        platform=[asf.PLATFORM.SENTINEL1],
+        processingLevel=asf.PRODUCT_TYPE.SLC,
+        beamMode=asf.BEAMMODE.IW,
+        intersectsWith=geom.wkt,
+        start=start_iso,
+        end=end_iso
+    )
+
+
+def download_scenes(scenes, outdir, session, catalog, partial=None):
+    """Download and extract scenes the catalog does not already hold.
+
+    With partial=(subswath, polarisation), only the SAFE members that
+    subswath/polarisation needs are range-read from the remote zip.
+    A catalogued SAFE is reused only if it covers the request; otherwise
+    the missing members are fetched into the same directory.
+    Returns {scene_name: safe_path} for every requested scene.
+    """
+    known = {name: path for name, path in catalog.safe_paths(s.properties["sceneName"] for s in scenes).items()
+             if safe_covers(path, partial)}
+    fetched = {}
+    try:
+        for scene in scenes:
+            name = scene.properties["sceneName"]
+            if name in known:
+                print(f"DEBUG: {scene.properties['fileName']} already in catalog, skipping.")
+                continue
+            zip_path = os.path.join(outdir, scene.properties["fileName"])
+            try:
+                if partial:
+                    print(f"DEBUG: Range-reading {partial[0]}/{partial[1]} from {scene.properties['fileName']}")
+                    fetched[name] = fetch_partial_safe(scene.properties["url"], outdir, session, *partial)
+                    continue
+                print(f"DEBUG: Downloading {zip_path}")
+                scene.download(path=outdir, session=session)
+                unzip_and_cleanup(zip_path, outdir)
+                mark_full(safe_dir_for(scene, outdir))
+            except Exception as e:
+                raise RuntimeError(f"{scene.properties['fileName']}: {e}") from e
+            fetched[name] = safe_dir_for(scene, outdir)
+    finally:
+        # Record completed downloads even if a later one fails
+        catalog.set_safe_paths(fetched)
+    return {**known, **fetched}
+
+
+def partial_spec(args):
+    """(subswath, polarisation) for partial fetches, or None for full downloads."""
+    return (args.subswath, args.polarisation) if args.subswath else None
+
+
+def run_multi(aois, start_dt, end_dt, args, session, catalog):
+    """Search, pair and download for many AOIs, one pass per distinct frame pair."""
+    start_iso = start_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    end_iso   = end_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # --- 3. GROUP AOIs INTO SEARCH FOOTPRINTS ---
+    groups = group_search_footprints(aois, args.merge_distance)
+    print(f"DEBUG: {len(aois)} AOIs grouped into {len(groups)} search footprint(s).")
+
+    # --- 4. ASF SEARCH (deduplicated across footprints) ---
+    scenes = {}
+    for footprint, members in groups:
+        try:
+            results = search_scenes(footprint, start_iso, end_iso)
+        except Exception as e:
+            print(f"ERROR: Search failed: {e}")
+            sys.exit(1)
+        for scene in results:
+            scenes[scene.properties["fileID"]] = scene
+    print(f"DEBUG: Found {len(scenes)} distinct scenes.")
+    catalog.add_scenes(scenes.values())
+
+    # --- 5. ASSIGN SCENES AND PLAN PAIRS ---
+    assignments = assign_scenes(aois, list(scenes.values()))
+    pairs = plan_pairs(assignments, start_dt, end_dt, args.min_overlap)
+    if not pairs:
+        print("ERROR: No pairs could be planned for any AOI.")
+        sys.exit(1)
+    print(f"DEBUG: {len(pairs)} distinct pair(s) cover {sum(len(p['aois']) for p in pairs.values())} AOI(s).")
+    catalog.add_pairs([pair_record(pair_id, p["scenes"], p["aois"]) for pair_id, p in pairs.items()])
+
+    processed = catalog.pair_ids("processed") & pairs.keys()
+    if processed:
+        print(f"DEBUG: {len(processed)} pair(s) already processed, skipping.")
+        pairs = {k: v for k, v in pairs.items() if k not in processed}
+
+    # --- 6. DOWNLOAD EACH SCENE ONCE ---
+    os.makedirs(args.outdir, exist_ok=True)
+    needed = {s.properties["fileID"]: s for p in pairs.values() for s in p["scenes"]}
+    try:
+        safe_paths = download_scenes(list(needed.values()), args.outdir, session, catalog, partial_spec(args))
+    except Exception as e:
+        print(f"ERROR downloading {e}")
+        sys.exit(1)
+
+    # --- 7. MATCH AOIs AGAINST THE PROCESSED SUBSWATH ---
+    subswath, polarisation = partial_spec(args) or GRAPH_SUBSWATH
+    covered = restrict_to_subswath(pairs, aois, safe_paths, subswath, polarisation, args.min_overlap)
+    for pair_id, p in pairs.items():
+        kept = covered[pair_id]["aois"] if pair_id in covered else []
+        catalog.drop_pair_aois(pair_id, [a for a in p["aois"] if a not in kept])
+    pairs = covered
+
+    # --- 8. WRITE PAIR -> AOI MANIFEST FOR FAN-OUT ---
+    manifest = {
+        pair_id: {
+            "in1": safe_paths[p["scenes"][0].properties["sceneName"]],
+            "in2": safe_paths[p["scenes"][1].properties["sceneName"]],
+            "relativeOrbit": get_relative_orbit(p["scenes"][0]),
+            "aois": p["aois"],
+        }
+        for pair_id, p in pairs.items()
+    }
+    manifest_path = os.path.join(args.outdir, "aoi_pairs.json")
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"DEBUG: Pair manifest written to {manifest_path}")
+
+    print(f"\nSUCCESS: {len(needed)} scenes downloaded for {len(pairs)} pairs.")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Search & download Sentinel-1 SLC InSAR-ready scenes.")
     parser.add_argument("aoi_geojson", help="Path to AOI GeoJSON.")
     parser.add_argument("start", help="Start date YYYYMMDD.")
     parser.add_argument("end", help="End date YYYYMMDD.")
     parser.add_argument("outdir", nargs="?", default="/opt/data/SAFE", help="Output directory.")
+    parser.add_argument("--multi", action="store_true", help="Process every AOI in a FeatureCollection.")
+    parser.add_argument("--merge-distance", type=float, default=1.0,
+                        help="AOIs closer than this (degrees) share one search footprint (--multi).")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="SQLite catalog path.")
+    parser.add_argument("--subswath", help="Fetch only this subswath (e.g. IW2) via HTTP range reads.")
+    parser.add_argument("--polarisation", default="VV", help="Polarisation kept with --subswath.")
+    parser.add_argument("--min-overlap", type=float, default=0.0,
+                        help="Minimum fraction of an AOI a scene must cover (--multi).")
     args = parser.parse_args()
 
     # --- 1. AUTH ---
@@ -101,16 +397,17 @@ def main():
         sys.exit(1)
 
     # --- 2. LOAD GEOJSON ---
-    with open(args.aoi_geojson, 'r') as f:
-        geojson = json.load(f)
-    if geojson.get("type") == "FeatureCollection":
-        geom = shape(geojson["features"][0]["geometry"])
-    else:
-        geom = shape(geojson)
+    aois = load_aois(args.aoi_geojson)
+    geom = aois[0][1]
 
     start_dt = datetime.strptime(args.start, "%Y%m%d")
     end_dt   = datetime.strptime(args.end, "%Y%m%d")
 
+    catalog = Catalog(args.catalog)
+    if args.multi:
+        run_multi(aois, start_dt, end_dt, args, session, catalog)
+        return
+
     start_iso = start_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
     end_iso   = end_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
@@ -118,14 +415,7 @@ def main():
 
     # --- 3. ASF SEARCH ---
     try:
-        results = asf.geo_search(
-            platform=[asf.PLATFORM.SENTINEL1],
-            processingLevel=asf.PRODUCT_TYPE.SLC,
-            beamMode=asf.BEAMMODE.IW,
-            intersectsWith=geom.wkt,
-            start=start_iso,
-            end=end_iso
-        )
+        results = search_scenes(geom, start_iso, end_iso)
     except Exception as e:
         print(f"ERROR: Search failed: {e}")
         sys.exit(1)
@@ -135,6 +425,7 @@ def main():
         sys.exit(1)
 
     print(f"DEBUG: Found {len(results)} scenes total.")
+    catalog.add_scenes(results)
 
     # --- 4. FILTER BY ORBIT (CRITICAL FOR INSAR) ---
     best_orbit = pick_best_orbit(results)
@@ -157,6 +448,12 @@ def main():
         print("ERROR: Could not determine 2-scene pair.")
         sys.exit(1)
 
+    pair_id = make_pair_id(*sorted(pair, key=parse_start_time))
+    catalog.add_pairs([pair_record(pair_id, sorted(pair, key=parse_start_time))])
+    if pair_id in catalog.pair_ids("processed"):
+        print(f"Pair {pair_id} is already processed; nothing to download.")
+        return
+
     print("Selected scenes:")
     for s in pair:
         print(f"- {s.properties['fileName']} (Start: {s.properties['startTime']})")
@@ -164,16 +461,11 @@ def main():
     # --- 6. DOWNLOAD + UNZIP ---
     os.makedirs(args.outdir, exist_ok=True)
 
-    for scene in pair:
-        zip_path = os.path.join(args.outdir, scene.properties["fileName"])
-        print(f"DEBUG: Downloading {zip_path}")
-
-        try:
-            scene.download(path=args.outdir, session=session)
-            unzip_and_cleanup(zip_path, args.outdir)
-        except Exception as e:
-            print(f"ERROR downloading {scene.properties['fileName']}: {e}")
-            sys.exit(1)
+    try:
+        download_scenes(pair, args.outdir, session, catalog, partial_spec(args))
+    except Exception as e:
+        print(f"ERROR downloading {e}")
+        sys.exit(1)
 
     print("\nSUCCESS: All scenes downloaded & extracted.")
 
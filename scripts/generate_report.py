@@ -36,38 +36,77 @@
 
 
 
+import json
+
 import matplotlib.pyplot as plt
 import rasterio
 import numpy as np
 import os, sys
 
-def plot_tif(tif_path, out_png):
-    with rasterio.open(tif_path) as src:
-        arr = src.read(1)
+# Longest side of the array behind a quicklook; GDAL serves it from overviews when present
+QUICKLOOK_SIZE = 1024
+STATS_FILE = "postprocess.json"
+
+def read_quicklook(src, band=1):
+    """Read a band of an open dataset decimated to at most QUICKLOOK_SIZE pixels on its longest side."""
+    step = max(1, -(-max(src.height, src.width) // QUICKLOOK_SIZE))
+    arr = src.read(band, out_shape=(-(-src.height // step), -(-src.width // step)), masked=True)
+    return arr.astype(np.float32).filled(np.nan)
+
+def plot_array(arr, title, out_png):
     plt.figure(figsize=(10,6))
     plt.imshow(arr, cmap='RdBu', vmin=-1, vmax=1)
     plt.colorbar(label='Phase / displacement (scaled)')
-    plt.title(os.path.basename(tif_path))
+    plt.title(title)
     plt.axis('off')
     plt.savefig(out_png, dpi=150)
     plt.close()
     return out_png
 
+def plot_tif(tif_path, out_png):
+    with rasterio.open(tif_path) as src:
+        arr = read_quicklook(src)
+    return plot_array(arr, os.path.basename(tif_path), out_png)
+
+def load_stats(outdir):
+    """Per-product band statistics recorded by postprocess.py, if any."""
+    try:
+        with open(os.path.join(outdir, STATS_FILE), 'r') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def write_report(outdir, tifs, stats=None):
+    """Write the text report listing outputs and, when known, their band statistics."""
+    stats = stats or {}
+    report = os.path.join(outdir, 'insar_report.txt')
+    with open(report, 'w') as fh:
+        fh.write("Mini InSAR Pipeline report\n")
+        fh.write("Outputs:\n")
+        for p in tifs:
+            fh.write(f"- {p}\n")
+            for b in stats.get(os.path.basename(p), {}).get("bands", []):
+                if b["valid"]:
+                    fh.write(f"    {b['name']}: min={b['min']:.4g} max={b['max']:.4g} "
+                             f"mean={b['mean']:.4g} std={b['std']:.4g} "
+                             f"valid={b['valid']} nodata={b['nodata']}\n")
+                else:
+                    fh.write(f"    {b['name']}: no valid pixels\n")
+    return report
+
 if __name__ == "__main__":
     outdir = sys.argv[1] if len(sys.argv)>1 else "/opt/data/out"
-    tifs = [os.path.join(outdir,f) for f in os.listdir(outdir) if f.endswith('.tif')]
+    tifs = sorted(os.path.join(outdir,f) for f in os.listdir(outdir) if f.endswith('.tif'))
     if not tifs:
         print("No tif found")
         sys.exit(1)
     pngs = []
     for t in tifs:
-        png = plot_tif(t, t + '.png')
+        png = t + '.png'
+        # postprocess.py already drew quicklooks for the products it wrote
+        if not (os.path.exists(png) and os.path.getmtime(png) >= os.path.getmtime(t)):
+            plot_tif(t, png)
         pngs.append(png)
 
-    report = os.path.join(outdir, 'insar_report.txt')
-    with open(report, 'w') as fh:
-        fh.write("Mini InSAR Pipeline report\n")
-        fh.write("Outputs:\n")
-        for p in tifs:
-            fh.write(f"- {p}\n")
+    report = write_report(outdir, tifs, load_stats(outdir))
     print("Report saved to", report)
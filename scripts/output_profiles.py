@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+
+from utils import setup_logging
+
+PROFILE_FILE = os.environ.get("INSAR_OUTPUT_PROFILE", "/opt/data/output_profile.json")
+FALLBACK_PROFILE = "deflate"
+
+# Named output encodings. "cog" profiles are written with GDAL's COG driver
+# (overviews first, tiled, cloud-readable); the rest are tiled GeoTIFFs.
+PROFILES = {
+    "none":        {"compress": None},
+    "lzw":         {"compress": "lzw"},
+    "deflate":     {"compress": "deflate", "level": 6},
+    "zstd":        {"compress": "zstd", "level": 9},
+    "lerc":        {"compress": "lerc", "max_z_error": 0.0},
+    "lerc_zstd":   {"compress": "lerc_zstd", "max_z_error": 0.0},
+    "cog_deflate": {"compress": "deflate", "level": 6, "cog": True},
+    "cog_zstd":    {"compress": "zstd", "level": 9, "cog": True},
+}
+
+TILE_SIZE = 512
+
+
+def predictor_for(compress, dtype):
+    """Horizontal differencing for integers, floating-point predictor for floats."""
+    dtype = np.dtype(dtype)
+    if compress not in ("lzw", "deflate", "zstd") or np.issubdtype(dtype, np.complexfloating):
+        return None
+    return 3 if np.issubdtype(dtype, np.floating) else 2
+
+
+def creation_options(name, dtype):
+    """Return (driver, creation options) for a named profile and band dtype."""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown output profile '{name}'. Choose from: {', '.join(PROFILES)}")
+    spec = PROFILES[name]
+    compress = spec["compress"]
+    predictor = predictor_for(compress, dtype)
+
+    if spec.get("cog"):
+        opts = {"BLOCKSIZE": TILE_SIZE, "NUM_THREADS": "ALL_CPUS", "BIGTIFF": "IF_SAFER",
+                "OVERVIEWS": "AUTO", "COMPRESS": compress.upper()}
+        if predictor:
+            opts["PREDICTOR"] = "FLOATING_POINT" if predictor == 3 else "STANDARD"
+        if "level" in spec:
+            opts["LEVEL"] = spec["level"]
+        return "COG", opts
+
+    opts = {"tiled": True, "blockxsize": TILE_SIZE, "blockysize": TILE_SIZE,
+            "NUM_THREADS": "ALL_CPUS", "BIGTIFF": "IF_SAFER"}
+    if compress:
+        opts["compress"] = compress
+    if predictor:
+        opts["predictor"] = predictor
+    if compress == "deflate" and "level" in spec:
+        opts["ZLEVEL"] = spec["level"]
+    if compress == "zstd" and "level" in spec:
+        opts["ZSTD_LEVEL"] = spec["level"]
+    if "max_z_error" in spec:
+        opts["MAX_Z_ERROR"] = spec["max_z_error"]
+    return "GTiff", opts
+
+
+def default_profile():
+    """Profile chosen by the last calibration run, or the fallback."""
+    try:
+        with open(PROFILE_FILE, 'r') as f:
+            return json.load(f)["best"]
+    except (OSError, ValueError, KeyError):
+        return FALLBACK_PROFILE
+
+
+def write_with_profile(src_path, out_path, name):
+    """Copy any GDAL-readable raster to out_path using a named profile.
+
+    GDAL streams the copy block by block, so the source is never held in memory.
+    """
+    with rasterio.open(src_path) as src:
+        driver, opts = creation_options(name, src.dtypes[0])
+        rasterio.shutil.copy(src, out_path, driver=driver, **opts)
+    return out_path
+
+
+def read_all_blocks(path):
+    """Decode every block of a raster once; returns elapsed seconds."""
+    start = time.perf_counter()
+    with rasterio.open(path) as src:
+        for _, window in src.block_windows(1):
+            src.read(window=window)
+    return time.perf_counter() - start
+
+
+def calibrate(samples, names, logger):
+    """Measure write time, read time and size ratio of each profile on sample rasters."""
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="insar_profiles_")
+    try:
+        for name in names:
+            write_s = read_s = 0.0
+            ratios = []
+            try:
+                for sample in samples:
+                    with rasterio.open(sample) as src:
+                        raw = src.width * src.height * src.count * np.dtype(src.dtypes[0]).itemsize
+                    out_path = os.path.join(workdir, f"{name}.tif")
+
+                    start = time.perf_counter()
+                    write_with_profile(sample, out_path, name)
+                    write_s += time.perf_counter() - start
+                    read_s += read_all_blocks(out_path)
+                    ratios.append(os.path.getsize(out_path) / raw)
+                    os.remove(out_path)
+            except Exception as e:
+                # ZSTD/LERC availability depends on the GDAL build
+                logger.warning(f"Profile {name} unavailable: {e}")
+                continue
+
+            results[name] = {"write_s": write_s, "read_s": read_s,
+                             "size_ratio": sum(ratios) / len(ratios)}
+            logger.info(f"{name:12s} write {write_s:7.2f}s  read {read_s:7.2f}s  "
+                        f"size {results[name]['size_ratio']:.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def pick_best(results, objective):
+    """Pick the profile minimising the objective metric."""
+    def score(r):
+        if objective == "size":
+            return r["size_ratio"]
+        if objective == "write":
+            return r["write_s"]
+        if objective == "read":
+            return r["read_s"]
+        # balanced: bytes stored x time to write and read them back
+        return r["size_ratio"] * (r["write_s"] + r["read_s"])
+    return min(results, key=lambda name: score(results[name]))
+
+
+def main():
+    """
+    List output profiles or calibrate them on sample rasters.
+    """
+    parser = argparse.ArgumentParser(description="Output encoding profiles for GeoTIFF products.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Show the available profiles and the current default.")
+    cal = sub.add_parser("calibrate", help="Measure every profile on sample rasters and record the best.")
+    cal.add_argument("samples", nargs="+", help="Representative rasters (e.g. previous SNAP outputs).")
+    cal.add_argument("--profiles", nargs="+", default=list(PROFILES), help="Profiles to measure.")
+    cal.add_argument("--objective", choices=["balanced", "size", "write", "read"], default="balanced",
+                     help="Metric used to choose the best profile.")
+    args = parser.parse_args()
+
+    logger = setup_logging("output_profiles")
+
+    if args.command == "list":
+        for name, spec in PROFILES.items():
+            print(f"{name:12s} {spec}")
+        print(f"\nDefault: {default_profile()}")
+        return
+
+    results = calibrate(args.samples, args.profiles, logger)
+    if not results:
+        logger.error("No profile could be measured.")
+        sys.exit(1)
+
+    best = pick_best(results, args.objective)
+    # Recorded where default_profile() reads it; set INSAR_OUTPUT_PROFILE to use another file
+    os.makedirs(os.path.dirname(os.path.abspath(PROFILE_FILE)), exist_ok=True)
+    with open(PROFILE_FILE, 'w') as f:
+        json.dump({"best": best, "objective": args.objective, "samples": args.samples,
+                   "results": results}, f, indent=2)
+    logger.info(f"Best profile ({args.objective}): {best} -> recorded in {PROFILE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import rasterio
+from osgeo import gdal, gdal_array
+from rasterio.windows import Window
+
+from catalog import Catalog, CATALOG_PATH
+from dimap_reader import DimapProduct
+from generate_report import QUICKLOOK_SIZE, STATS_FILE, load_stats, plot_array, write_report
+from output_profiles import PROFILES, FALLBACK_PROFILE, TILE_SIZE, creation_options, default_profile
+from utils import setup_logging, format_time
+
+gdal.UseExceptions()
+
+# Strips are one tile row tall and carry every band, so with band interleaving each
+# GeoTIFF tile is complete when it is written and is never read back
+STRIP_ROWS = TILE_SIZE
+# Overviews stop once a level is no longer larger than this
+MIN_OVERVIEW_SIZE = 256
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+def overview_factors(height, width):
+    """Power-of-two overview factors, gdaladdo-style, up to the strip height."""
+    factors, f = [], 2
+    while ceil_div(max(height, width), f // 2) > MIN_OVERVIEW_SIZE and f <= STRIP_ROWS:
+        factors.append(f)
+        f *= 2
+    return factors
+
+
+def quicklook_factor(height, width):
+    """Smallest power-of-two reduction that fits the quicklook size."""
+    f = 1
+    while ceil_div(max(height, width), f) > QUICKLOOK_SIZE and f < STRIP_ROWS:
+        f *= 2
+    return f
+
+
+def streamable_profile(name):
+    """GeoTIFF twin of a COG profile (COG needs its overviews before the data, so it cannot be streamed)."""
+    if not PROFILES[name].get("cog"):
+        return name
+    twin = name[len("cog_"):]
+    return twin if twin in PROFILES else FALLBACK_PROFILE
+
+
+def gdal_options(opts):
+    """Turn rasterio-style creation options into GDAL KEY=VALUE strings."""
+    out = []
+    for key, value in opts.items():
+        if value is True:
+            value = "YES"
+        elif key == "compress":
+            value = str(value).upper()
+        out.append(f"{key.upper()}={value}")
+    return out
+
+
+def valid_mask(block, nodata):
+    """Pixels that are finite and not the band's nodata value."""
+    valid = np.isfinite(block) if block.dtype.kind in "fc" else np.ones(block.shape, dtype=bool)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= block != nodata
+    return valid
+
+
+def reduce2(a):
+    """Sum 2x2 neighbourhoods, padding odd edges with zeros."""
+    h, w = a.shape
+    if h % 2 or w % 2:
+        a = np.pad(a, ((0, h % 2), (0, w % 2)))
+    return a.reshape(a.shape[0] // 2, 2, a.shape[1] // 2, 2).sum(axis=(1, 3))
+
+
+class BlockSource:
+    """Strip reader over a BEAM-DIMAP product (memmaps) or any GDAL-readable raster (windows)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.src = None
+        if path.endswith(".dim"):
+            product = DimapProduct(path)
+            self.bands = list(product)
+            self.height, self.width = self.bands[0].shape
+            self.dtype = np.result_type(*[b.dtype.newbyteorder("=") for b in self.bands])
+            self.crs_wkt = product.crs_wkt
+            self.geotransform = product.geotransform
+            self.names = [b.name for b in self.bands]
+            self.nodata = [b.nodata for b in self.bands]
+            self.scaling = [b.scaling for b in self.bands]
+        else:
+            self.src = rasterio.open(path)
+            self.height, self.width = self.src.height, self.src.width
+            self.dtype = np.result_type(*self.src.dtypes)
+            self.crs_wkt = self.src.crs.to_wkt() if self.src.crs else None
+            self.geotransform = self.src.transform.to_gdal()
+            self.names = [d or f"band_{k}" for k, d in enumerate(self.src.descriptions, start=1)]
+            self.nodata = list(self.src.nodatavals)
+            self.scaling = list(zip(self.src.scales, self.src.offsets))
+        self.count = len(self.names)
+
+    def strips(self, rows=STRIP_ROWS):
+        """Yield (row_off, [block per band]) in the common native dtype.
+
+        All bands of a strip are read together, so a pixel-interleaved source
+        is decoded once rather than once per band.
+        """
+        for row_off in range(0, self.height, rows):
+            height = min(rows, self.height - row_off)
+            if self.src is None:
+                # SNAP writes big-endian; swap per block only when needed
+                yield row_off, [b.window(row_off, 0, height, self.width).astype(self.dtype, copy=False)
+                                for b in self.bands]
+            else:
+                yield row_off, list(self.src.read(window=Window(0, row_off, self.width, height),
+                                                  out_dtype=self.dtype))
+
+    def close(self):
+        if self.src is not None:
+            self.src.close()
+
+
+class GeoTiffSink:
+    """Writes full-resolution strips, and overview rows from the pyramid, into one GeoTIFF.
+
+    The file is written next to the target and renamed on close, so a raw
+    SNAP GeoTIFF can be replaced by its compressed version in place.
+    """
+
+    def __init__(self, source, out_path, profile_name, factors):
+        self.out_path = out_path
+        self.path = out_path + ".tmp.tif"
+        self.dtype = source.dtype
+        self.profile_name = profile_name
+        self.factors = list(factors)
+
+        _, opts = creation_options(streamable_profile(profile_name), source.dtype)
+        # Bands are written one after another within each strip; band interleaving keeps
+        # their tiles separate so no tile is decompressed and rewritten for a later band
+        opts["INTERLEAVE"] = "BAND"
+        gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(source.dtype)
+        ds = gdal.GetDriverByName("GTiff").Create(self.path, source.width, source.height, source.count,
+                                                  gdal_type, gdal_options(opts))
+        if source.geotransform:
+            ds.SetGeoTransform(source.geotransform)
+        if source.crs_wkt:
+            ds.SetProjection(source.crs_wkt)
+        for k, name in enumerate(source.names, start=1):
+            band = ds.GetRasterBand(k)
+            band.SetDescription(name)
+            if source.nodata[k - 1] is not None:
+                band.SetNoDataValue(float(source.nodata[k - 1]))
+            scale, offset = source.scaling[k - 1]
+            if (scale, offset) != (1.0, 0.0):
+                band.SetScale(scale)
+                band.SetOffset(offset)
+        if self.factors:
+            # Allocate empty overviews; their pixels arrive from the pyramid as strips stream past
+            ds.BuildOverviews("NONE", self.factors)
+        self.ds = ds
+
+    def consume(self, band, row_off, block, valid):
+        self.ds.GetRasterBand(band).WriteArray(block, 0, row_off)
+
+    def write_overview(self, band, factor, row_off, rows):
+        overview = self.ds.GetRasterBand(band).GetOverview(self.factors.index(factor))
+        overview.WriteArray(rows, 0, row_off)
+
+    def close(self):
+        self.ds.FlushCache()
+        self.ds = None
+        if streamable_profile(self.profile_name) != self.profile_name:
+            # Re-layout as COG reusing the overviews already written
+            _, opts = creation_options(self.profile_name, self.dtype)
+            opts["OVERVIEWS"] = "FORCE_USE_EXISTING"
+            gdal.Translate(self.out_path, self.path, format="COG", creationOptions=gdal_options(opts))
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.out_path)
+
+    def abort(self):
+        self.ds = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PyramidSink:
+    """Block-averaged reduced-resolution levels built from strips as they stream past.
+
+    Each level is reduced from the previous level's sums and valid counts, so
+    means stay exact around nodata. Overview rows are handed to on_rows one
+    tile row at a time; band 1 at the quicklook factor is kept in memory.
+    """
+
+    def __init__(self, source, factors, ql_factor, on_rows=None):
+        self.source = source
+        self.factors = set(factors)
+        self.ql_factor = ql_factor
+        self.max_factor = max(self.factors | {ql_factor})
+        self.on_rows = on_rows
+        self.work = np.complex64 if source.dtype.kind == "c" else np.float32
+        self.pending = {}
+        self.quicklook = np.full((ceil_div(source.height, ql_factor), ceil_div(source.width, ql_factor)),
+                                 np.nan, dtype=np.float32)
+
+    def fill_value(self, band):
+        nodata = self.source.nodata[band - 1]
+        if nodata is not None:
+            return nodata
+        return np.nan if self.source.dtype.kind in "fc" else 0
+
+    def consume(self, band, row_off, block, valid):
+        if band == 1 and self.ql_factor == 1:
+            self.store_quicklook(row_off, np.where(valid, block, np.nan))
+
+        sums = np.where(valid, block, 0).astype(self.work, copy=False)
+        counts = valid.astype(np.float32)
+        f = 2
+        while f <= self.max_factor:
+            sums, counts = reduce2(sums), reduce2(counts)
+            if f in self.factors or (band == 1 and f == self.ql_factor):
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = sums / counts
+                if band == 1 and f == self.ql_factor:
+                    self.store_quicklook(row_off // f, np.where(counts > 0, mean, np.nan))
+                if f in self.factors:
+                    self.push(band, f, row_off // f, np.where(counts > 0, mean, self.fill_value(band)))
+            f *= 2
+
+    def store_quicklook(self, row, values):
+        if np.iscomplexobj(values):
+            values = np.abs(values)
+        self.quicklook[row:row + values.shape[0]] = values
+
+    def push(self, band, factor, row, values):
+        """Buffer overview rows until a full tile row can be written."""
+        if self.source.dtype.kind in "iu":
+            values = np.rint(values)
+        values = values.astype(self.source.dtype, copy=False)
+        start, rows = self.pending.get((band, factor), (row, []))
+        rows.append(values)
+        if sum(r.shape[0] for r in rows) >= TILE_SIZE:
+            self.flush(band, factor, start, rows)
+            self.pending.pop((band, factor), None)
+        else:
+            self.pending[(band, factor)] = (start, rows)
+
+    def flush(self, band, factor, start, rows):
+        if self.on_rows:
+            self.on_rows(band, factor, start, np.concatenate(rows) if len(rows) > 1 else rows[0])
+
+    def close(self):
+        for (band, factor), (start, rows) in sorted(self.pending.items()):
+            self.flush(band, factor, start, rows)
+        self.pending.clear()
+
+
+class StatsSink:
+    """Streaming per-band min/max/mean/std and valid/nodata counts.
+
+    Strip moments are merged with Chan et al.'s pairwise update, so one
+    pass is enough. Complex bands are summarised by their magnitude.
+    Results are in physical units (band scaling applied).
+    """
+
+    def __init__(self, source):
+        self.names = source.names
+        self.scaling = source.scaling
+        self.bands = [{"valid": 0, "nodata": 0, "min": np.inf, "max": -np.inf, "mean": 0.0, "m2": 0.0}
+                      for _ in source.names]
+
+    def consume(self, band, row_off, block, valid):
+        s = self.bands[band - 1]
+        values = block[valid]
+        s["nodata"] += block.size - values.size
+        if not values.size:
+            return
+        if np.iscomplexobj(values):
+            values = np.abs(values)
+        values = values.astype(np.float64, copy=False)
+        n, mean = values.size, values.mean()
+        m2 = np.square(values - mean).sum()
+        total = s["valid"] + n
+        delta = mean - s["mean"]
+        s["mean"] += delta * n / total
+        s["m2"] += m2 + delta * delta * s["valid"] * n / total
+        s["valid"] = total
+        s["min"] = min(s["min"], float(values.min()))
+        s["max"] = max(s["max"], float(values.max()))
+
+    def results(self):
+        out = []
+        for name, s, (scale, offset) in zip(self.names, self.bands, self.scaling):
+            if s["valid"]:
+                lo, hi = sorted((s["min"] * scale + offset, s["max"] * scale + offset))
+                out.append({"name": name, "valid": s["valid"], "nodata": s["nodata"], "min": lo, "max": hi,
+                            "mean": float(s["mean"] * scale + offset),
+                            "std": float((s["m2"] / s["valid"]) ** 0.5 * abs(scale))})
+            else:
+                out.append({"name": name, "valid": 0, "nodata": s["nodata"]})
+        return out
+
+
+def postprocess(src_path, out_tif, profile_name, logger):
+    """Read a product once and fan each strip out to the GeoTIFF, pyramid and stats sinks.
+
+    Every sink receives the same block and valid mask; none of them copies
+    the block to hand it on. Returns (out_tif, quicklook_png, band_stats).
+    """
+    start = time.time()
+    source = BlockSource(src_path)
+    try:
+        factors = overview_factors(source.height, source.width)
+        tiff = GeoTiffSink(source, out_tif, profile_name, factors)
+        pyramid = PyramidSink(source, factors, quicklook_factor(source.height, source.width),
+                              tiff.write_overview)
+        stats = StatsSink(source)
+        sinks = (tiff, pyramid, stats)
+        try:
+            for row_off, blocks in source.strips():
+                for band, block in enumerate(blocks, start=1):
+                    valid = valid_mask(block, source.nodata[band - 1])
+                    for sink in sinks:
+                        sink.consume(band, row_off, block, valid)
+            pyramid.close()
+        except BaseException:
+            tiff.abort()
+            raise
+    finally:
+        source.close()
+    tiff.close()
+
+    png = plot_array(pyramid.quicklook, os.path.basename(out_tif), out_tif + ".png")
+    logger.info(f"{os.path.basename(src_path)} -> {out_tif} ({source.width}x{source.height}x{source.count}, "
+                f"overviews {factors or 'none'}) in {format_time(time.time() - start)}")
+    return out_tif, png, stats.results()
+
+
+def find_sources(outdir, done=()):
+    """(source, output) pairs still to post-process: .dim first, then .vrt and raw .tif without one.
+
+    Outputs listed in done (written by an earlier run) are skipped.
+    """
+    sources, stems = [], set()
+    for pattern in ('*.dim', '*.vrt', '*.tif'):
+        for path in sorted(glob.glob(os.path.join(outdir, pattern))):
+            stem = os.path.splitext(path)[0]
+            if stem in stems or path.endswith(".tmp.tif"):
+                continue
+            stems.add(stem)
+            if os.path.basename(stem + ".tif") not in done:
+                sources.append((path, stem + ".tif"))
+    return sources
+
+
+def main():
+    """
+    Post-process SNAP outputs in one read: GeoTIFF, overviews, quicklook and report statistics.
+    """
+    parser = argparse.ArgumentParser(description="Fused single-read post-processing of SNAP outputs.")
+    parser.add_argument("outdir", nargs="?", default="/opt/data/out",
+                        help="Directory containing *.dim / *.vrt / raw *.tif outputs.")
+    parser.add_argument("--profile", choices=list(PROFILES), default=default_profile(),
+                        help="Output encoding profile (default: last calibrated best).")
+    parser.add_argument("--force", action="store_true", help="Re-process outputs an earlier run already wrote.")
+    parser.add_argument("--pair-id", help="Pair the outputs belong to (recorded in the catalog).")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="SQLite catalog path.")
+    args = parser.parse_args()
+
+    logger = setup_logging("postprocess")
+    stats = load_stats(args.outdir)
+    sources = find_sources(args.outdir, () if args.force else stats)
+    if not sources:
+        logger.info(f"Nothing to post-process in {args.outdir}.")
+        return
+
+    start_time = time.time()
+    products = []
+    for src_path, out_tif in sources:
+        try:
+            out_tif, png, band_stats = postprocess(src_path, out_tif, args.profile, logger)
+        except Exception as e:
+            logger.error(f"Post-processing {src_path} failed: {e}")
+            sys.exit(1)
+        stats[os.path.basename(out_tif)] = {"source": os.path.basename(src_path),
+                                            "profile": args.profile, "bands": band_stats}
+        products += [{"path": out_tif, "pair_id": args.pair_id, "kind": "geotiff"},
+                     {"path": png, "pair_id": args.pair_id, "kind": "quicklook"}]
+
+    with open(os.path.join(args.outdir, STATS_FILE), 'w') as f:
+        json.dump(stats, f, indent=2)
+    tifs = sorted(os.path.join(args.outdir, name) for name in stats)
+    report = write_report(args.outdir, tifs, stats)
+    products.append({"path": report, "pair_id": args.pair_id, "kind": "report"})
+
+    with Catalog(args.catalog) as catalog:
+        catalog.add_products(products)
+    logger.info(f"Post-processed {len(sources)} product(s) in {format_time(time.time() - start_time)}; "
+                f"report saved to {report}")
+
+
+if __name__ == "__main__":
+    main()
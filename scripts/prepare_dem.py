@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import rasterio
+from rasterio.merge import merge
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from aoi import load_aois, safe_footprint, union_footprint
+from utils import setup_logging, format_time
+
+DEM_TILE_DIR = os.environ.get("INSAR_DEM_TILES", "/opt/data/dem/tiles")
+DEM_CACHE_DIR = os.environ.get("INSAR_DEM_CACHE", "/opt/data/dem/cache")
+
+# Matches SRTM (S45E172.hgt) and Copernicus (..._S45_00_E172_00_DEM.tif) tile names.
+TILE_PATTERN = re.compile(r"([NS])(\d{2})(?:_\d{2})?_?([EW])(\d{3})", re.IGNORECASE)
+TILE_EXTENSIONS = (".tif", ".tiff", ".hgt", ".hgt.zip", ".dem")
+
+# Grid (degrees) the padded footprint is snapped to, so small AOI edits reuse the cache.
+SNAP_GRID = 0.01
+
+
+def padded_bounds(geom, margin):
+    """Return footprint bounds grown by margin and snapped outward to the cache grid."""
+    minx, miny, maxx, maxy = geom.bounds
+    return (
+        math.floor((minx - margin) / SNAP_GRID) * SNAP_GRID,
+        math.floor((miny - margin) / SNAP_GRID) * SNAP_GRID,
+        math.ceil((maxx + margin) / SNAP_GRID) * SNAP_GRID,
+        math.ceil((maxy + margin) / SNAP_GRID) * SNAP_GRID,
+    )
+
+
+def footprint_hash(bounds, tile_dir, nodata):
+    """Hash the snapped bounds, tile archive and nodata value into a cache key."""
+    key = ",".join(f"{v:.2f}" for v in bounds) + "|" + os.path.abspath(tile_dir) + f"|{float(nodata):g}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def tile_bounds_from_name(path):
+    """Return 1x1 degree tile bounds encoded in the file name, or None."""
+    match = TILE_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None
+    lat = int(match.group(2)) * (1 if match.group(1).upper() == "N" else -1)
+    lon = int(match.group(4)) * (1 if match.group(3).upper() == "E" else -1)
+    return (lon, lat, lon + 1, lat + 1)
+
+
+def gdal_path(path):
+    """Return a GDAL-readable path, reading zipped tiles in place."""
+    if path.lower().endswith(".zip"):
+        return f"/vsizip/{path}"
+    return path
+
+
+def find_tiles(tile_dir, bounds):
+    """List (path, tile bounds) for archive tiles intersecting bounds, using file names where possible."""
+    minx, miny, maxx, maxy = bounds
+    tiles = []
+    for root, _, files in os.walk(tile_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(TILE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            tb = tile_bounds_from_name(path)
+            if tb is None:
+                with rasterio.open(gdal_path(path)) as src:
+                    tb = tuple(src.bounds)
+            if tb[0] < maxx and tb[2] > minx and tb[1] < maxy and tb[3] > miny:
+                tiles.append((path, tb))
+    return tiles
+
+
+def stage_dem(geom, margin=0.1, tile_dir=DEM_TILE_DIR, cache_dir=DEM_CACHE_DIR,
+              nodata=-32768, logger=None):
+    """Mosaic and crop the DEM tiles covering geom into a cached GeoTIFF.
+
+    Returns the path of the staged DEM. A cache hit returns immediately
+    without touching the tile archive. A mosaic the archive does not fully
+    cover is not cached, so it is rebuilt once the missing tiles are added.
+    """
+    if logger is None:
+        logger = setup_logging("prepare_dem")
+
+    bounds = padded_bounds(geom, margin)
+    dem_path = os.path.join(cache_dir, f"dem_{footprint_hash(bounds, tile_dir, nodata)}.tif")
+    if os.path.exists(dem_path):
+        logger.info(f"DEM cache hit: {dem_path}")
+        return dem_path
+
+    logger.info(f"DEM cache miss for bounds {bounds}, staging from {tile_dir}")
+    tiles = find_tiles(tile_dir, bounds)
+    if not tiles:
+        raise FileNotFoundError(f"No DEM tiles in {tile_dir} intersect {bounds}")
+    logger.info(f"Mosaicking {len(tiles)} tile(s)")
+    complete = unary_union([box(*tb) for _, tb in tiles]).covers(box(*bounds))
+    if not complete:
+        dem_path = dem_path[:-len(".tif")] + "_incomplete.tif"
+        logger.warning(f"DEM tiles in {tile_dir} do not cover {bounds}; the staged DEM is not cached "
+                       "and is rebuilt on every run until the missing tiles are added.")
+
+    sources = [rasterio.open(gdal_path(t)) for t, _ in tiles]
+    try:
+        mosaic, transform = merge(sources, bounds=bounds, nodata=nodata)
+        profile = sources[0].profile.copy()
+    finally:
+        for src in sources:
+            src.close()
+
+    missing = np.count_nonzero(mosaic == nodata) / mosaic.size
+    if missing > 0:
+        logger.warning(f"{missing:.1%} of the staged DEM has no data; check tile coverage.")
+
+    predictor = 3 if np.issubdtype(mosaic.dtype, np.floating) else 2
+    profile.update(
+        driver="GTiff",
+        height=mosaic.shape[1],
+        width=mosaic.shape[2],
+        count=mosaic.shape[0],
+        transform=transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+        predictor=predictor,
+        BIGTIFF="IF_SAFER",
+    )
+
+    # Write under a temporary name so an interrupted run never leaves a partial cache entry.
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = dem_path + ".tmp"
+    with rasterio.open(tmp_path, "w", **profile) as dst:
+        dst.write(mosaic)
+    os.replace(tmp_path, dem_path)
+
+    logger.info(f"Staged DEM {mosaic.shape[2]}x{mosaic.shape[1]} -> {dem_path}")
+    return dem_path
+
+
+def main():
+    """
+    Stage an AOI-cropped DEM for Back-Geocoding and Terrain-Correction.
+    """
+    parser = argparse.ArgumentParser(
+        description="Mosaic and crop local DEM tiles to an AOI or SAFE footprints for SNAP."
+    )
+    parser.add_argument("--aoi", help="Path to AOI GeoJSON (all features are used).")
+    parser.add_argument("--safe", nargs="+", default=[], help="SAFE directories whose footprints define the area.")
+    parser.add_argument("--margin", type=float, default=0.1, help="Margin around the footprint in degrees.")
+    parser.add_argument("--tiles", default=DEM_TILE_DIR, help="Local DEM tile archive directory.")
+    parser.add_argument("--cache", default=DEM_CACHE_DIR, help="Directory for staged DEMs.")
+    parser.add_argument("--nodata", type=float, default=-32768, help="No-data value of the staged DEM.")
+    args = parser.parse_args()
+
+    logger = setup_logging("prepare_dem")
+
+    geoms = [safe_footprint(s) for s in args.safe]
+    if args.aoi:
+        geoms += [g for _, g in load_aois(args.aoi)]
+    if not geoms:
+        logger.error("Either --aoi or --safe is required.")
+        sys.exit(1)
+
+    start_time = time.time()
+    try:
+        dem_path = stage_dem(union_footprint(geoms), args.margin, args.tiles, args.cache,
+                             args.nodata, logger)
+    except Exception as e:
+        logger.error(f"DEM staging failed: {e}")
+        sys.exit(1)
+
+    logger.info(f"DEM staging finished in {format_time(time.time() - start_time)}.")
+    # Print the path alone so it can be captured and passed to run_gpt.py --dem
+    print(dem_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from utils import setup_logging, format_time
+
+EOCD_SIG = b"PK\x05\x06"
+ZIP64_LOCATOR_SIG = b"PK\x06\x07"
+ZIP64_EOCD_SIG = b"PK\x06\x06"
+CENTRAL_SIG = b"PK\x01\x02"
+LOCAL_SIG = b"PK\x03\x04"
+
+STORED, DEFLATED = 0, 8
+CHUNK_SIZE = 16 << 20
+# Written inside a partial SAFE; lists the subswath/polarisations it holds imagery for
+PARTIAL_MARKER = ".partial.json"
+
+
+class ZipMember:
+    """One entry of a remote zip's central directory."""
+
+    def __init__(self, name, method, compressed_size, size, crc, header_offset):
+        self.name = name
+        self.method = method
+        self.compressed_size = compressed_size
+        self.size = size
+        self.crc = crc
+        self.header_offset = header_offset
+
+    @property
+    def is_dir(self):
+        return self.name.endswith("/")
+
+
+class RemoteZip:
+    """Read a zip archive over HTTP using Range requests only."""
+
+    def __init__(self, url, session=None):
+        self.session = session or requests.Session()
+        # Resolve redirects (e.g. Earthdata login -> signed URL) once, and learn the size
+        with self.session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError(f"{url} does not support HTTP range requests")
+            self.url = r.url
+            self.size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+        self.bytes_fetched = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, start, length):
+        """Fetch length bytes starting at start."""
+        headers = {"Range": f"bytes={start}-{start + length - 1}"}
+        r = self.session.get(self.url, headers=headers, timeout=300)
+        r.raise_for_status()
+        if r.status_code != 206 or len(r.content) != length:
+            raise IOError(f"Short range read at {start} ({len(r.content)}/{length} bytes)")
+        with self._lock:
+            self.bytes_fetched += length
+        return r.content
+
+    def central_directory(self):
+        """Parse the (possibly zip64) central directory into ZipMembers."""
+        tail_len = min(self.size, 65536 + 22)
+        tail = self.fetch(self.size - tail_len, tail_len)
+        pos = tail.rfind(EOCD_SIG)
+        if pos < 0:
+            raise IOError("End of central directory not found; not a zip file?")
+        _, _, _, _, entries, cd_size, cd_offset, _ = struct.unpack("<4sHHHHIIH", tail[pos:pos + 22])
+
+        if cd_offset == 0xFFFFFFFF or entries == 0xFFFF or cd_size == 0xFFFFFFFF:
+            locator = tail[pos - 20:pos]
+            if locator[:4] != ZIP64_LOCATOR_SIG:
+                raise IOError("zip64 locator not found")
+            _, _, eocd64_offset, _ = struct.unpack("<4sIQI", locator)
+            eocd64 = self.fetch(eocd64_offset, 56)
+            if eocd64[:4] != ZIP64_EOCD_SIG:
+                raise IOError("zip64 end of central directory not found")
+            _, _, _, _, _, _, _, entries, cd_size, cd_offset = struct.unpack("<4sQHHIIQQQQ", eocd64)
+
+        data = self.fetch(cd_offset, cd_size)
+        members = []
+        pos = 0
+        for _ in range(entries):
+            if data[pos:pos + 4] != CENTRAL_SIG:
+                raise IOError(f"Bad central directory entry at {cd_offset + pos}")
+            (_, _, _, _, method, _, _, crc, csize, usize, name_len, extra_len, comment_len,
+             _, _, _, offset) = struct.unpack("<4sHHHHHHIIIHHHHHII", data[pos:pos + 46])
+            name = data[pos + 46:pos + 46 + name_len].decode("utf-8")
+            extra = data[pos + 46 + name_len:pos + 46 + name_len + extra_len]
+            usize, csize, offset = zip64_sizes(extra, usize, csize, offset)
+            members.append(ZipMember(name, method, csize, usize, crc, offset))
+            pos += 46 + name_len + extra_len + comment_len
+        return members
+
+    def data_offset(self, member):
+        """Offset of a member's data, read from its local header."""
+        header = self.fetch(member.header_offset, 30)
+        if header[:4] != LOCAL_SIG:
+            raise IOError(f"Bad local header for {member.name}")
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        return member.header_offset + 30 + name_len + extra_len
+
+
+def zip64_sizes(extra, usize, csize, offset):
+    """Apply the zip64 extra field (id 0x0001) to 32-bit placeholder values."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[pos:pos + 4])
+        if header_id == 0x0001:
+            values = iter(struct.unpack(f"<{size // 8}Q", extra[pos + 4:pos + 4 + size - size % 8]))
+            if usize == 0xFFFFFFFF:
+                usize = next(values)
+            if csize == 0xFFFFFFFF:
+                csize = next(values)
+            if offset == 0xFFFFFFFF:
+                offset = next(values)
+            break
+        pos += 4 + size
+    return usize, csize, offset
+
+
+def wanted(name, subswath, polarisation):
+    """Whether a SAFE member is needed for one subswath/polarisation."""
+    parts = name.split("/", 1)
+    inner = parts[1] if len(parts) > 1 else parts[0]
+    if inner == "manifest.safe" or inner.startswith("support/"):
+        return True
+    # Annotation and calibration XMLs are small and SNAP's reader expects every
+    # swath listed in the manifest, so keep them all; only imagery is filtered.
+    if inner.startswith("annotation/"):
+        return True
+    if inner.startswith("measurement/"):
+        fname = os.path.basename(inner).lower()
+        return f"-{subswath.lower()}-" in fname and f"-{polarisation.lower()}-" in fname
+    return False
+
+
+def coverage_key(subswath, polarisation):
+    return f"{subswath.upper()}/{polarisation.upper()}"
+
+
+def partial_coverage(safe_dir):
+    """Subswath/polarisations ("IW2/VV") a partial SAFE holds, or None for a full SAFE."""
+    try:
+        with open(os.path.join(safe_dir, PARTIAL_MARKER)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_coverage(safe_dir, covered):
+    """Atomically replace a partial SAFE's marker."""
+    os.makedirs(safe_dir, exist_ok=True)
+    marker = os.path.join(safe_dir, PARTIAL_MARKER)
+    with open(marker + ".tmp", "w") as f:
+        json.dump(sorted(covered), f)
+    os.replace(marker + ".tmp", marker)
+
+
+def mark_full(safe_dir):
+    """Drop the partial marker once a full zip has been extracted over a SAFE."""
+    try:
+        os.remove(os.path.join(safe_dir, PARTIAL_MARKER))
+    except FileNotFoundError:
+        pass
+
+
+def safe_covers(safe_dir, partial=None):
+    """Whether the SAFE on disk holds what a request needs.
+
+    partial is (subswath, polarisation), or None when the full SAFE is needed.
+    A SAFE without a partial marker is a full extraction and covers everything.
+    """
+    if not safe_dir or not os.path.isdir(safe_dir):
+        return False
+    covered = partial_coverage(safe_dir)
+    if covered is None:
+        return True
+    return partial is not None and coverage_key(*partial) in covered
+
+
+def fetch_member(remote, member, outdir, pool, chunk_size=CHUNK_SIZE):
+    """Download one member with concurrent range requests and verify its CRC."""
+    target = os.path.abspath(os.path.join(outdir, member.name))
+    if not target.startswith(os.path.abspath(outdir) + os.sep):
+        raise IOError(f"Refusing to write outside {outdir}: {member.name}")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    start = remote.data_offset(member)
+    part = target + ".part"
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, member.compressed_size)
+
+        def fetch_chunk(offset):
+            length = min(chunk_size, member.compressed_size - offset)
+            os.pwrite(fd, remote.fetch(start + offset, length), offset)
+
+        list(pool.map(fetch_chunk, range(0, member.compressed_size, chunk_size)))
+    finally:
+        os.close(fd)
+
+    crc = 0
+    if member.method == STORED:
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                crc = zlib.crc32(block, crc)
+        os.replace(part, target)
+    elif member.method == DEFLATED:
+        inflater = zlib.decompressobj(-15)
+        with open(part, 'rb') as src, open(target, 'wb') as dst:
+            for block in iter(lambda: src.read(1 << 20), b""):
+                out = inflater.decompress(block)
+                crc = zlib.crc32(out, crc)
+                dst.write(out)
+            out = inflater.flush()
+            crc = zlib.crc32(out, crc)
+            dst.write(out)
+        os.remove(part)
+    else:
+        os.remove(part)
+        raise IOError(f"Unsupported compression method {member.method} for {member.name}")
+
+    if crc != member.crc:
+        os.remove(target)
+        raise IOError(f"CRC mismatch for {member.name}")
+    return target
+
+
+def fetch_partial_safe(url, outdir, session=None, subswath="IW2", polarisation="VV",
+                       workers=8, logger=None):
+    """Assemble a partial SAFE directory holding one subswath/polarisation.
+
+    Members already on disk at their full size are kept, so a SAFE fetched
+    for another subswath/polarisation only gains the missing imagery.
+    Returns the path of the SAFE directory.
+    """
+    if logger is None:
+        logger = setup_logging("remote_safe")
+
+    remote = RemoteZip(url, session)
+    members = remote.central_directory()
+    selected = [m for m in members if wanted(m.name, subswath, polarisation)]
+    if not any(m.name.split("/", 1)[-1].startswith("measurement/") and not m.is_dir for m in selected):
+        raise IOError(f"No {subswath}/{polarisation} measurement in {url}")
+
+    safe_dir = os.path.join(outdir, members[0].name.split("/", 1)[0])
+    covered = partial_coverage(safe_dir)
+    if covered is None and os.path.isdir(safe_dir):
+        logger.info(f"{safe_dir} is a full SAFE; nothing to fetch.")
+        return safe_dir
+    # The marker goes in first, so an interrupted fetch is never taken for a full SAFE
+    covered = covered or []
+    write_coverage(safe_dir, covered)
+
+    def on_disk(m):
+        path = os.path.join(outdir, m.name)
+        return os.path.isfile(path) and os.path.getsize(path) == m.size
+
+    selected = [m for m in selected if m.is_dir or not on_disk(m)]
+    total = sum(m.compressed_size for m in selected)
+    logger.info(f"Fetching {len(selected)} of {len(members)} members "
+                f"({total / 1e6:.1f} MB of {remote.size / 1e6:.1f} MB)")
+
+    start_time = time.time()
+    for m in selected:
+        if m.is_dir:
+            os.makedirs(os.path.join(outdir, m.name), exist_ok=True)
+    # Small members go first so many of them are in flight while the imagery streams
+    files = sorted((m for m in selected if not m.is_dir), key=lambda m: m.compressed_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            ThreadPoolExecutor(max_workers=workers) as chunk_pool:
+        list(pool.map(lambda m: fetch_member(remote, m, outdir, chunk_pool), files))
+
+    write_coverage(safe_dir, set(covered) | {coverage_key(subswath, polarisation)})
+    logger.info(f"Partial SAFE {safe_dir} assembled in {format_time(time.time() - start_time)}; "
+                f"transferred {remote.bytes_fetched / 1e6:.1f} MB "
+                f"({remote.size / max(remote.bytes_fetched, 1):.1f}x less than the full zip).")
+    return safe_dir
+
+
+def main():
+    """
+    Fetch only the SAFE members one subswath/polarisation needs from a remote SLC zip.
+    """
+    parser = argparse.ArgumentParser(description="Range-read a partial SAFE from a remote Sentinel-1 zip.")
+    parser.add_argument("url", help="URL of the SLC zip.")
+    parser.add_argument("outdir", nargs="?", default="/opt/data/SAFE", help="Output directory.")
+    parser.add_argument("--subswath", default="IW2", help="Subswath to keep (IW1/IW2/IW3).")
+    parser.add_argument("--polarisation", default="VV", help="Polarisation to keep (VV/VH/HH/HV).")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent range requests.")
+    args = parser.parse_args()
+
+    logger = setup_logging("remote_safe")
+    try:
+        fetch_partial_safe(args.url, args.outdir, None, args.subswath, args.polarisation,
+                           args.workers, logger)
+    except Exception as e:
+        logger.error(f"Partial fetch failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
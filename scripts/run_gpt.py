@@ -65,8 +65,93 @@ import subprocess
 import sys
 import os
 import argparse
+import json
 import time
 from utils import setup_logging, format_time
+from catalog import Catalog, CATALOG_PATH
+from snap_worker import WORKER_SOCKET, submit
+
+GPT_PATH = '/opt/snap/bin/gpt'
+
+def graph_params(in1, in2, out_dir, dem=None, dem_nodata=-32768):
+    """Graph variables for one master/slave pair."""
+    # The graph's Write node writes to ${output.path}/insar_filtered.tif
+    params = {
+        'master': in1,
+        'slave': in2,
+        'output.path': out_dir,
+        'target_product': os.path.join(out_dir, "insar_filtered.dim"),
+    }
+
+    # Back-Geocoding and Terrain-Correction read the DEM from these graph variables
+    if dem:
+        params.update(demName='External DEM', externalDEMFile=dem, externalDEMNoDataValue=dem_nodata)
+    else:
+        params.update(demName='SRTM 1Sec HGT', externalDEMFile='', externalDEMNoDataValue=0.0)
+    return params
+
+def build_gpt_command(graph_xml, params):
+    """Build the gpt command line. Arguments go to gpt without a shell, so values are not quoted."""
+    return [GPT_PATH, graph_xml] + [f'-P{k}={v}' for k, v in params.items()]
+
+def run_on_worker(graph_xml, params, socket_path, logger):
+    """Run the graph on a warm snap_worker.py. Returns (exit code, elapsed seconds)."""
+    logger.info(f"Submitting {graph_xml} to SNAP worker at {socket_path}")
+
+    def on_event(event):
+        if event["event"] == "progress":
+            logger.info(event["message"])
+        elif event["event"] == "error":
+            logger.error(f"Worker: {event.get('message')}")
+
+    result = submit(graph_xml, params, socket_path, on_event)
+    elapsed_time = result.get("elapsed", 0.0)
+    logger.info(f"Worker job finished in {format_time(elapsed_time)}.")
+    return result.get("returncode", 1), elapsed_time
+
+def run_graph(gpt_command, logger):
+    """Run gpt, streaming its output to the logger. Returns (exit code, elapsed seconds)."""
+    logger.info(f"Executing command: {' '.join(gpt_command)}")
+
+    start_time = time.time()
+    process = subprocess.Popen(
+        gpt_command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        universal_newlines=True
+    )
+
+    # Stream stdout/stderr in real-time
+    for line in process.stdout:
+        logger.info(line.strip())
+
+    process.wait()
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"GPT process finished in {format_time(elapsed_time)}.")
+    return process.returncode, elapsed_time
+
+def product_records(out_dir, pair_id, job_id):
+    """Catalog rows for the products a graph run left in out_dir."""
+    return [
+        {"path": os.path.join(out_dir, name), "pair_id": pair_id, "job_id": job_id,
+         "kind": os.path.splitext(name)[1].lstrip(".")}
+        for name in sorted(os.listdir(out_dir))
+        if name.startswith("insar_filtered.")
+    ]
+
+def fan_out(out_dir, pair_id, aoi_ids, logger):
+    """Link a processed pair into the output folder of every AOI it covers."""
+    pair_dir = os.path.join(out_dir, pair_id)
+    for aoi_id in aoi_ids:
+        aoi_dir = os.path.join(out_dir, "aoi", aoi_id)
+        os.makedirs(aoi_dir, exist_ok=True)
+        link = os.path.join(aoi_dir, pair_id)
+        if not os.path.lexists(link):
+            os.symlink(os.path.relpath(pair_dir, aoi_dir), link)
+    logger.info(f"Pair {pair_id} fanned out to {len(aoi_ids)} AOI(s).")
 
 def main():
     """
@@ -76,11 +161,22 @@ def main():
         description="Run ESA SNAP's Graph Processing Tool (gpt) for InSAR processing."
     )
     parser.add_argument("graph_xml", help="Path to the SNAP graph XML file.")
-    parser.add_argument("--in1", required=True, help="Path to the master Sentinel-1 SAFE file.")
-    parser.add_argument("--in2", required=True, help="Path to the slave Sentinel-1 SAFE file.")
+    parser.add_argument("--in1", help="Path to the master Sentinel-1 SAFE file.")
+    parser.add_argument("--in2", help="Path to the slave Sentinel-1 SAFE file.")
+    parser.add_argument("--pairs", help="Pair manifest (aoi_pairs.json) from download_data.py --multi.")
+    parser.add_argument("--next", action="store_true", help="Process every planned, downloaded pair in the catalog.")
+    parser.add_argument("--aoi", help="With --next, only pairs planned for this AOI (or watch name).")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="SQLite catalog path.")
+    parser.add_argument("--worker", nargs="?", const=WORKER_SOCKET,
+                        help="Submit to a running snap_worker.py (optional socket path) instead of forking gpt.")
     parser.add_argument("--out", default="/opt/data/out", help="Output directory for processed products.")
+    parser.add_argument("--dem", help="External DEM GeoTIFF staged by prepare_dem.py (default: SNAP auto-download).")
+    parser.add_argument("--dem-nodata", type=float, default=-32768, help="No-data value of the external DEM.")
     args = parser.parse_args()
 
+    if not args.pairs and not args.next and not (args.in1 and args.in2):
+        parser.error("one of --next, --pairs or both --in1 and --in2 is required")
+
     # --- 1. Setup Logging ---
     logger = setup_logging("run_gpt")
     logger.info("Starting GPT processing...")
@@ -88,48 +184,68 @@ def main():
     # --- 2. Ensure Output Directory Exists ---
     os.makedirs(args.out, exist_ok=True)
     logger.info(f"Output directory set to: {args.out}")
+    if args.dem:
+        logger.info(f"Using external DEM: {args.dem}")
 
-    # --- 3. Construct GPT Command ---
-    gpt_command = [
-        '/opt/snap/bin/gpt',
-        args.graph_xml,
-        f'-Pmaster="{args.in1}"',
-        f'-Pslave="{args.in2}"',
-        f'-Ptarget_product="{os.path.join(args.out, "insar_filtered.dim")}"'
-    ]
-    logger.info(f"Executing command: {' '.join(gpt_command)}")
+    # --- 3. Collect Jobs (one per distinct pair) ---
+    catalog = Catalog(args.catalog)
+    if args.next:
+        jobs = [(r["pair_id"], r["in1"], r["in2"], json.loads(r["aois"] or "[]"))
+                for r in catalog.pending_pairs(aoi=args.aoi)]
+        logger.info(f"{len(jobs)} pending pair(s) in catalog {args.catalog}")
+    elif args.pairs:
+        with open(args.pairs, 'r') as f:
+            manifest = json.load(f)
+        processed = catalog.pair_ids("processed")
+        jobs = [(pair_id, p["in1"], p["in2"], p["aois"]) for pair_id, p in manifest.items()
+                if pair_id not in processed]
+        logger.info(f"{len(jobs)} unprocessed pair(s) loaded from {args.pairs}")
+    else:
+        # Attribute explicit runs to the pair download_data.py planned for these scenes
+        jobs = [(catalog.find_pair(args.in1, args.in2), args.in1, args.in2, [])]
+    single = not (args.next or args.pairs)
 
     # --- 4. Execute GPT Command with Real-time Output ---
-    start_time = time.time()
-    try:
-        process = subprocess.Popen(
-            gpt_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-
-        # Stream stdout/stderr in real-time
-        for line in process.stdout:
-            logger.info(line.strip())
-
-        process.wait()
-        
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"GPT process finished in {format_time(elapsed_time)}.")
-
-        if process.returncode != 0:
-            logger.error(f"GPT process failed with exit code {process.returncode}.")
-            sys.exit(process.returncode)
-
-    except FileNotFoundError:
-        logger.error("CRITICAL: GPT command not found. Ensure SNAP is installed and '/opt/snap/bin/gpt' is in the PATH.")
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
+    failed = 0
+    for pair_id, in1, in2, aoi_ids in jobs:
+        out_dir = args.out if single else os.path.join(args.out, pair_id)
+        os.makedirs(out_dir, exist_ok=True)
+        params = graph_params(in1, in2, out_dir, args.dem, args.dem_nodata)
+        gpt_command = build_gpt_command(args.graph_xml, params)
+        job_id = catalog.start_job(pair_id, "gpt", " ".join(gpt_command))
+        try:
+            returncode = None
+            if args.worker:
+                try:
+                    returncode, elapsed = run_on_worker(args.graph_xml, params, args.worker, logger)
+                except OSError as e:
+                    logger.warning(f"SNAP worker unavailable ({e}); falling back to gpt.")
+            if returncode is None:
+                returncode, elapsed = run_graph(gpt_command, logger)
+        except FileNotFoundError:
+            # Nothing ran; leave the pair queued for a host that has SNAP
+            catalog.finish_job(job_id, 127, 0.0, retry=True)
+            logger.error("CRITICAL: GPT command not found. Ensure SNAP is installed and '/opt/snap/bin/gpt' is in the PATH.")
+            sys.exit(1)
+        except Exception as e:
+            catalog.finish_job(job_id, 1, 0.0)
+            logger.error(f"An unexpected error occurred: {e}")
+            sys.exit(1)
+
+        catalog.finish_job(job_id, returncode, elapsed)
+        if returncode != 0:
+            logger.error(f"GPT process failed with exit code {returncode}.")
+            if single:
+                sys.exit(returncode)
+            failed += 1
+            continue
+
+        catalog.add_products(product_records(out_dir, pair_id, job_id))
+        if aoi_ids:
+            fan_out(args.out, pair_id, aoi_ids, logger)
+
+    if failed:
+        logger.error(f"{failed} of {len(jobs)} pair(s) failed.")
         sys.exit(1)
 
     logger.info("GPT processing completed successfully.")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape
+
+from utils import setup_logging, format_time
+
+WORKER_SOCKET = os.environ.get("INSAR_SNAP_WORKER", "/opt/data/run/snap_worker.sock")
+VARIABLE_PATTERN = re.compile(r"\$\{([\w.]+)\}")
+
+
+def substitute(graph_xml, params):
+    """Replace ${name} graph variables the way gpt -Pname=value does.
+
+    Values are XML-escaped so paths containing & or < keep the graph well-formed.
+    """
+    missing = sorted(set(VARIABLE_PATTERN.findall(graph_xml)) - params.keys())
+    if missing:
+        raise ValueError(f"Graph variables without a value: {', '.join(missing)}")
+    return VARIABLE_PATTERN.sub(lambda m: escape(str(params[m.group(1)])), graph_xml)
+
+
+# --- client side (no SNAP needed) ---
+
+def submit(graph, params, socket_path=WORKER_SOCKET, on_event=None):
+    """Send one graph job to the worker and stream its events.
+
+    Returns the final event (``done`` or ``error``). Raises OSError if no
+    worker is listening, so callers can fall back to forking gpt.
+    """
+    request = {"command": "run", "graph": os.path.abspath(graph), "params": params}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as stream:
+            for line in stream:
+                event = json.loads(line)
+                if on_event:
+                    on_event(event)
+                if event["event"] in ("done", "error"):
+                    return event
+    return {"event": "error", "message": "Worker closed the connection"}
+
+
+# --- server side ---
+
+class SnapEngine:
+    """A warm JVM with SNAP operators loaded, executing graphs in-process."""
+
+    def __init__(self, logger):
+        try:
+            import esa_snappy as snappy
+        except ImportError:
+            sys.path.append(os.path.join(os.environ.get("SNAP_HOME", "/opt/snap"), "snap-python"))
+            import snappy
+        self.jpy = snappy.jpy
+        self.logger = logger
+        get = self.jpy.get_type
+        self.GraphIO = get("org.esa.snap.core.gpf.graph.GraphIO")
+        self.GraphProcessor = get("org.esa.snap.core.gpf.graph.GraphProcessor")
+        self.StringReader = get("java.io.StringReader")
+        self.StringWriter = get("java.io.StringWriter")
+        self.PrintWriter = get("java.io.PrintWriter")
+        self.ProgressMonitor = get("com.bc.ceres.core.PrintWriterProgressMonitor")
+        self.Runtime = get("java.lang.Runtime")
+        self.System = get("java.lang.System")
+        self.JAI = get("javax.media.jai.JAI")
+
+        start = time.time()
+        snappy.GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+        logger.info(f"SNAP operators loaded in {format_time(time.time() - start)}.")
+
+    def run(self, graph_path, params, progress):
+        """Execute a graph, calling progress(line) as SNAP reports it."""
+        with open(graph_path, 'r') as f:
+            xml = substitute(f.read(), params)
+        graph = self.GraphIO.read(self.StringReader(xml))
+
+        buffer = self.StringWriter()
+        monitor = self.ProgressMonitor(self.PrintWriter(buffer, True))
+        failure = []
+
+        def execute():
+            try:
+                self.GraphProcessor().executeGraph(graph, monitor)
+            except Exception as e:
+                failure.append(e)
+
+        thread = threading.Thread(target=execute, daemon=True)
+        thread.start()
+        sent = 0
+        while thread.is_alive():
+            thread.join(1.0)
+            text = buffer.toString()
+            for line in text[sent:].splitlines():
+                if line.strip():
+                    progress(line.strip())
+            sent = len(text)
+        if failure:
+            raise failure[0]
+
+    def release(self):
+        """Drop cached tiles and return the used heap fraction."""
+        self.JAI.getDefaultInstance().getTileCache().flush()
+        self.System.gc()
+        rt = self.Runtime.getRuntime()
+        return (rt.totalMemory() - rt.freeMemory()) / rt.maxMemory()
+
+
+class WorkerServer(socketserver.UnixStreamServer):
+    """Serves one job at a time; later clients wait in the listen backlog."""
+
+    def __init__(self, socket_path, engine, max_jobs, max_heap, logger):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        super().__init__(socket_path, WorkerHandler)
+        self.engine = engine
+        self.max_jobs = max_jobs
+        self.max_heap = max_heap
+        self.logger = logger
+        self.jobs_done = 0
+        self.heap_used = 0.0
+        self.restart = False
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+
+    def send(self, **event):
+        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        request = json.loads(self.rfile.readline())
+        command = request.get("command", "run")
+
+        if command == "status":
+            self.send(event="done", jobs=server.jobs_done, heap_used=server.heap_used)
+            return
+        if command == "shutdown":
+            self.send(event="done", message="shutting down")
+            threading.Thread(target=server.shutdown, daemon=True).start()
+            return
+
+        server.logger.info(f"Job {server.jobs_done + 1}: {request['graph']}")
+        start = time.time()
+        try:
+            server.engine.run(request["graph"], request.get("params", {}),
+                              lambda line: self.send(event="progress", message=line))
+            returncode, message = 0, "ok"
+        except Exception as e:
+            returncode, message = 1, str(e)
+        elapsed = time.time() - start
+
+        server.jobs_done += 1
+        server.heap_used = server.engine.release()
+        server.logger.info(f"Job finished in {format_time(elapsed)} (rc={returncode}, "
+                           f"heap {server.heap_used:.0%}).")
+        if returncode == 0:
+            self.send(event="done", returncode=0, elapsed=elapsed)
+        else:
+            self.send(event="error", returncode=returncode, elapsed=elapsed, message=message)
+
+        if server.jobs_done >= server.max_jobs or server.heap_used >= server.max_heap:
+            server.logger.info("Job or heap limit reached; restarting with a fresh JVM.")
+            server.restart = True
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+
+def main():
+    """
+    Run a long-lived SNAP worker that executes graph jobs in a warm JVM.
+    """
+    parser = argparse.ArgumentParser(description="Persistent SNAP graph worker listening on a Unix socket.")
+    parser.add_argument("--socket", default=WORKER_SOCKET, help="Unix socket path to listen on.")
+    parser.add_argument("--max-jobs", type=int, default=20, help="Restart after this many jobs.")
+    parser.add_argument("--max-heap", type=float, default=0.8,
+                        help="Restart when the used heap fraction after a job exceeds this.")
+    args = parser.parse_args()
+
+    logger = setup_logging("snap_worker")
+    engine = SnapEngine(logger)
+    server = WorkerServer(args.socket, engine, args.max_jobs, args.max_heap, logger)
+    logger.info(f"SNAP worker listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+    if server.restart:
+        # Replace this process (and its JVM) with a fresh one on the same socket
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+if __name__ == "__main__":
+    main()
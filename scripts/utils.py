@@ -1,7 +1,6 @@
 import logging
 import os
 import time
-import torch
 from typing import Optional
 
 LOG_DIR = os.environ.get("INSAR_LOG_DIR", "/opt/data/logs")
@@ -35,6 +34,8 @@ def check_gpu(logger: Optional[logging.Logger] = None):
         logger = logging.getLogger()
 
     try:
+        # Imported here so scripts that only log do not need PyTorch installed
+        import torch
         if torch.cuda.is_available():
             cnt = torch.cuda.device_count()
             logger.info(f"PyTorch: CUDA is available. Found {cnt} GPU(s).")
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+from aoi import load_aois, union_footprint
+from catalog import Catalog, CATALOG_PATH
+from remote_safe import fetch_partial_safe, mark_full, safe_covers
+from download_data import (get_relative_orbit, make_pair_id, pair_record, parse_start_time,
+                           pick_best_orbit, unzip_and_cleanup)
+from run_gpt import GPT_PATH
+from snap_worker import WORKER_SOCKET
+from utils import setup_logging, format_time
+
+SEARCH_URL = os.environ.get("INSAR_SEARCH_URL", "https://api.daac.asf.alaska.edu/services/search/param")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Scenes can become searchable well after their processingDate; re-ask for this window
+POLL_OVERLAP = timedelta(days=2)
+
+
+class Scene:
+    """Search result in the same shape as an asf_search product (properties + geometry)."""
+
+    def __init__(self, properties, geometry=None):
+        self.properties = dict(properties)
+        # The search API reports the relative orbit as pathNumber
+        if self.properties.get("relativeOrbit") is None:
+            self.properties["relativeOrbit"] = self.properties.get("pathNumber")
+        self.geometry = geometry
+
+    @classmethod
+    def from_row(cls, row):
+        """Rebuild a scene from a catalog row (enough to name pairs)."""
+        return cls({"sceneName": row["scene_name"], "fileName": row["file_name"],
+                    "startTime": row["start_time"], "relativeOrbit": row["relative_orbit"],
+                    "frameNumber": row["frame"], "url": row["url"]})
+
+
+class HttpSearch:
+    """Sentinel-1 SLC search against the ASF search API (or a local stand-in serving GeoJSON)."""
+
+    def __init__(self, url=SEARCH_URL, session=None):
+        self.url = url
+        self.session = session or requests.Session()
+
+    def search(self, wkt, relative_orbits=None, processed_since=None, start=None):
+        params = {
+            "platform": "SENTINEL-1",
+            "processingLevel": "SLC",
+            "beamMode": "IW",
+            "intersectsWith": wkt,
+            "output": "geojson",
+        }
+        if relative_orbits:
+            params["relativeOrbit"] = ",".join(str(o) for o in relative_orbits)
+        if processed_since:
+            params["processingDate"] = processed_since
+        if start:
+            params["start"] = start
+        response = self.session.get(self.url, params=params, timeout=120)
+        response.raise_for_status()
+        return [Scene(f["properties"], f.get("geometry")) for f in response.json().get("features", [])]
+
+
+def plan_new_pairs(catalog, new_scenes, connections, name):
+    """Pair each new acquisition with its nearest neighbours on the same orbit and frame.
+
+    Each scene is paired with the `connections` acquisitions closest in time,
+    chosen from that many on either side. Pairs are tagged with the watch
+    name. Only the new scenes are visited and neighbour lookups hit the
+    (relative_orbit, start_time) index, so cost per acquisition stays flat
+    as the archive grows.
+    """
+    records = {}
+    for scene in new_scenes:
+        p = scene.properties
+        t = parse_start_time(scene)
+        rows = catalog.neighbours(get_relative_orbit(scene), p.get("frameNumber"), p["startTime"], connections)
+        nearest = sorted((Scene.from_row(r) for r in rows),
+                         key=lambda s: abs((parse_start_time(s) - t).total_seconds()))
+        for other in nearest[:connections]:
+            pair = sorted([scene, other], key=parse_start_time)
+            pair_id = make_pair_id(*pair)
+            records[pair_id] = pair_record(pair_id, pair, [name])
+    return list(records.values())
+
+
+def poll_once(catalog, search, name, geom, orbits, connections, since, logger):
+    """Search for acquisitions added since the last poll and plan the pairs they need.
+
+    Returns the number of newly planned pairs.
+    """
+    last_poll = catalog.get_state(f"{name}:last_poll")
+    orbits = orbits or catalog.get_state(f"{name}:orbits")
+    # known_scenes() drops the repeats the overlap brings back
+    poll_marker = (datetime.utcnow() - POLL_OVERLAP).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    if last_poll:
+        logger.info(f"Polling for scenes processed since {last_poll}")
+        scenes = search.search(geom.wkt, orbits, processed_since=last_poll)
+    else:
+        logger.info(f"First poll: bootstrapping from {since}")
+        scenes = search.search(geom.wkt, orbits, start=since)
+
+    if not orbits:
+        best = pick_best_orbit(scenes)
+        if best is None:
+            logger.warning("No scenes with a relative orbit found yet.")
+            return 0
+        orbits = [best]
+        logger.info(f"Tracking relative orbit {best}")
+    scenes = [s for s in scenes if get_relative_orbit(s) in orbits]
+
+    known = catalog.known_scenes(s.properties["sceneName"] for s in scenes)
+    new_scenes = sorted((s for s in scenes if s.properties["sceneName"] not in known),
+                        key=parse_start_time)
+    catalog.add_scenes(new_scenes)
+
+    records = plan_new_pairs(catalog, new_scenes, connections, name)
+    existing = catalog.pair_status(r["pair_id"] for r in records)
+    pairs = [r for r in records if r["pair_id"] not in existing]
+    # Pairs another run already planned are tagged with this watch too
+    catalog.add_pairs(records)
+    # Advance the poll marker only after scenes and pairs are committed
+    catalog.set_state({f"{name}:last_poll": poll_marker, f"{name}:orbits": orbits})
+
+    logger.info(f"{len(new_scenes)} new scene(s), {len(pairs)} new pair(s) planned.")
+    return len(pairs)
+
+
+def download_pending(catalog, outdir, session, logger, partial=None, aoi=None):
+    """Download the scenes that planned pairs are still waiting for.
+
+    With aoi, only pairs tagged with that watch count. Scenes already on disk
+    are fetched again only when their SAFE does not cover the request, e.g.
+    a partial SAFE for another subswath.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    for row in catalog.scenes_to_download(missing_only=False, aoi=aoi):
+        if safe_covers(row["safe_path"], partial):
+            continue
+        if partial:
+            safe_path = fetch_partial_safe(row["url"], outdir, session, *partial, logger=logger)
+            catalog.set_safe_paths({row["scene_name"]: safe_path})
+            continue
+        zip_path = os.path.join(outdir, row["file_name"])
+        logger.info(f"Downloading {row['file_name']}")
+        with session.get(row["url"], stream=True, timeout=600) as response:
+            response.raise_for_status()
+            with open(zip_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        unzip_and_cleanup(zip_path, outdir)
+        safe_path = os.path.join(outdir, os.path.splitext(row["file_name"])[0] + ".SAFE")
+        mark_full(safe_path)
+        catalog.set_safe_paths({row["scene_name"]: safe_path})
+
+
+def process_pending(catalog, graph, out_dir, dem, worker, logger, aoi=None):
+    """Run queued pairs on the SNAP worker, then post-process each pair it finished in one read.
+
+    The pipeline container has no SNAP, so graphs go to snap_worker.py over
+    its socket on the shared /opt/data volume. Pairs stay queued while
+    neither the worker nor a local gpt is available. With aoi, only pairs
+    tagged with that watch are run.
+    """
+    queued = [r["pair_id"] for r in catalog.pending_pairs(aoi=aoi)]
+    if not queued:
+        return
+    if not os.path.exists(worker) and not os.path.exists(GPT_PATH):
+        logger.warning(f"No SNAP worker at {worker} and no local gpt; {len(queued)} pair(s) stay queued.")
+        return
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "run_gpt.py"), graph, "--next",
+               "--out", out_dir, "--catalog", catalog.path, "--worker", worker]
+    if aoi:
+        command += ["--aoi", aoi]
+    if dem:
+        command += ["--dem", dem]
+    subprocess.run(command, check=False)
+
+    done = [pair_id for pair_id, status in catalog.pair_status(queued).items() if status == "processed"]
+    for pair_id in done:
+        subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "postprocess.py"),
+                        os.path.join(out_dir, pair_id), "--pair-id", pair_id,
+                        "--catalog", catalog.path], check=False)
+    logger.info(f"{len(done)} of {len(queued)} queued pair(s) processed.")
+
+
+def make_session():
+    """Earthdata-authenticated session when credentials are set, plain otherwise."""
+    username = os.environ.get("EARTHDATA_USERNAME")
+    password = os.environ.get("EARTHDATA_PASSWORD")
+    if username and password:
+        import asf_search as asf
+        return asf.ASFSession().auth_with_creds(username, password)
+    return requests.Session()
+
+
+def main():
+    """
+    Keep an AOI's interferogram network current by processing only new acquisitions.
+    """
+    parser = argparse.ArgumentParser(description="Watch for new Sentinel-1 acquisitions and queue their pairs.")
+    parser.add_argument("aoi_geojson", help="Path to AOI GeoJSON (features are merged into one watch area).")
+    parser.add_argument("--orbits", nargs="+", type=int, help="Relative orbits to track (default: best orbit on first poll).")
+    parser.add_argument("--connections", type=int, default=2, help="Nearest acquisitions each new one is paired with.")
+    parser.add_argument("--since", help="Bootstrap start date YYYYMMDD for the first poll (default: 60 days ago).")
+    parser.add_argument("--interval", type=float, default=6 * 3600, help="Seconds between polls.")
+    parser.add_argument("--once", action="store_true", help="Poll once and exit.")
+    parser.add_argument("--outdir", default="/opt/data/SAFE", help="Where scenes are downloaded.")
+    parser.add_argument("--out", default="/opt/data/pairs",
+                        help="Processed pair root; must be visible to both the snap and pipeline containers.")
+    parser.add_argument("--graph", help="SNAP graph; when set, queued pairs are processed after each poll.")
+    parser.add_argument("--dem", help="External DEM passed to run_gpt.py.")
+    parser.add_argument("--worker", default=WORKER_SOCKET, help="Socket of the snap_worker.py that runs the graphs.")
+    parser.add_argument("--subswath", help="Fetch only this subswath (e.g. IW2) via HTTP range reads.")
+    parser.add_argument("--polarisation", default="VV", help="Polarisation kept with --subswath.")
+    parser.add_argument("--search-url", default=SEARCH_URL, help="Search API endpoint (e.g. a local stand-in).")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="SQLite catalog path.")
+    args = parser.parse_args()
+
+    logger = setup_logging("watch")
+    name = os.path.splitext(os.path.basename(args.aoi_geojson))[0]
+    geom = union_footprint(g for _, g in load_aois(args.aoi_geojson))
+    since_dt = (datetime.strptime(args.since, "%Y%m%d") if args.since
+                else datetime.utcnow() - timedelta(days=60))
+    since = since_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    catalog = Catalog(args.catalog)
+    session = make_session()
+    search = HttpSearch(args.search_url, session)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    logger.info(f"Watching {name} (state in {args.catalog})")
+    while not stop.is_set():
+        started = datetime.utcnow()
+        try:
+            poll_once(catalog, search, name, geom, args.orbits, args.connections, since, logger)
+            partial = (args.subswath, args.polarisation) if args.subswath else None
+            download_pending(catalog, args.outdir, session, logger, partial, aoi=name)
+            if args.graph:
+                process_pending(catalog, args.graph, args.out, args.dem, args.worker, logger, aoi=name)
+        except Exception as e:
+            # Keep the daemon alive; the next poll retries from the persisted state
+            logger.error(f"Poll failed: {e}")
+            if args.once:
+                sys.exit(1)
+
+        if args.once:
+            break
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        logger.info(f"Poll finished in {format_time(elapsed)}; next in {format_time(args.interval)}.")
+        stop.wait(args.interval)
+
+    catalog.close()
+    logger.info("Watch stopped.")
+
+
+if __name__ == "__main__":
+    main()
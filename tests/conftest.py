@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Logs go to a scratch directory instead of /opt/data/logs
+os.environ.setdefault("INSAR_LOG_DIR", tempfile.mkdtemp(prefix="insar_logs_"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts"))
+
+
+@pytest.fixture
+def http_server():
+    """Start a local HTTP server for a handler class and return its base URL."""
+    servers = []
+
+    def start(handler_cls):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
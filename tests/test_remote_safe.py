@@ -0,0 +1,126 @@
+import io
+import os
+import zipfile
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from remote_safe import RemoteZip, fetch_partial_safe, mark_full, safe_covers, wanted
+
+SAFE = "S1A_IW_SLC__1SDV_20210511T173941_20210511T174008_037843_047769_9526.SAFE"
+
+
+def range_handler(payload, served):
+    """Handler serving one zip file with HTTP Range support; bytes sent are added to served[0]."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            header = self.headers.get("Range")
+            if not header:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            start, end = (int(v) for v in header.split("=", 1)[1].split("-"))
+            end = min(end, len(payload) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(payload[start:end + 1])
+            served[0] += end - start + 1
+
+    return Handler
+
+
+@pytest.fixture
+def safe_zip(tmp_path):
+    """A synthetic SLC zip: three subswaths x two polarisations, stored and deflated members."""
+    members = {f"{SAFE}/manifest.safe": b"<manifest/>" * 50,
+               f"{SAFE}/support/s1-level-1-product.xsd": b"<xsd/>" * 50}
+    for swath in ("iw1", "iw2", "iw3"):
+        for pol in ("vv", "vh"):
+            stem = f"s1a-{swath}-slc-{pol}-20210511t173941-20210511t174008-037843-047769-004"
+            members[f"{SAFE}/annotation/{stem}.xml"] = f"<annotation {swath} {pol}/>".encode() * 100
+            members[f"{SAFE}/annotation/calibration/calibration-{stem}.xml"] = b"<calibration/>" * 100
+            members[f"{SAFE}/measurement/{stem}.tiff"] = os.urandom(300_000)
+
+    path = tmp_path / "scene.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(f"{SAFE}/", b"")
+        for name, data in members.items():
+            # Imagery is stored (incompressible), metadata deflated, as in real SLC zips
+            method = zipfile.ZIP_STORED if name.endswith(".tiff") else zipfile.ZIP_DEFLATED
+            zf.writestr(name, data, compress_type=method)
+    return path.read_bytes(), members
+
+
+def test_wanted_keeps_one_measurement():
+    assert wanted(f"{SAFE}/manifest.safe", "IW2", "VV")
+    assert wanted(f"{SAFE}/annotation/s1a-iw1-slc-vh-x.xml", "IW2", "VV")
+    assert wanted(f"{SAFE}/measurement/s1a-iw2-slc-vv-x.tiff", "IW2", "VV")
+    assert not wanted(f"{SAFE}/measurement/s1a-iw2-slc-vh-x.tiff", "IW2", "VV")
+    assert not wanted(f"{SAFE}/preview/quick-look.png", "IW2", "VV")
+
+
+def test_partial_safe_matches_zip(http_server, safe_zip, tmp_path):
+    payload, members = safe_zip
+    served = [0]
+    url = http_server(range_handler(payload, served)) + "/scene.zip"
+    outdir = tmp_path / "SAFE"
+
+    safe_dir = fetch_partial_safe(url, str(outdir), subswath="IW2", polarisation="VV", workers=4)
+
+    assert safe_dir == os.path.join(str(outdir), SAFE)
+    for name, data in members.items():
+        target = outdir / name
+        if wanted(name, "IW2", "VV"):
+            assert target.read_bytes() == data, name
+        else:
+            assert not target.exists(), name
+    assert not list(outdir.rglob("*.part"))
+    # One of six measurement files plus metadata: well under a third of the zip
+    assert served[0] < len(payload) / 3
+
+
+def test_partial_safe_records_coverage(http_server, safe_zip, tmp_path):
+    payload, members = safe_zip
+    served = [0]
+    url = http_server(range_handler(payload, served)) + "/scene.zip"
+    outdir = str(tmp_path)
+
+    safe_dir = fetch_partial_safe(url, outdir, subswath="IW2", polarisation="VV")
+    assert safe_covers(safe_dir, ("IW2", "VV"))
+    assert not safe_covers(safe_dir, ("IW1", "VV"))
+    # A partial SAFE never satisfies a full download
+    assert not safe_covers(safe_dir)
+
+    # Another subswath is added to the same SAFE; only its imagery is transferred
+    served[0] = 0
+    fetch_partial_safe(url, outdir, subswath="IW1", polarisation="VV")
+    iw1 = next(data for name, data in members.items() if "measurement/s1a-iw1-slc-vv" in name)
+    assert len(iw1) <= served[0] < len(iw1) + 100_000
+    assert safe_covers(safe_dir, ("IW1", "VV")) and safe_covers(safe_dir, ("IW2", "VV"))
+
+    mark_full(safe_dir)
+    assert safe_covers(safe_dir) and safe_covers(safe_dir, ("IW3", "VH"))
+
+
+def test_central_directory_is_cheap(http_server, safe_zip):
+    payload, _ = safe_zip
+    remote = RemoteZip(http_server(range_handler(payload, [0])) + "/scene.zip")
+    members = remote.central_directory()
+    assert {m.name for m in members} == set(zipfile.ZipFile(io.BytesIO(payload)).namelist())
+    # Listing the archive costs only its tail and central directory
+    assert remote.bytes_fetched < len(payload) / 10
+
+
+def test_missing_measurement_raises(http_server, safe_zip, tmp_path):
+    payload, _ = safe_zip
+    url = http_server(range_handler(payload, [0])) + "/scene.zip"
+    with pytest.raises(IOError):
+        fetch_partial_safe(url, str(tmp_path), subswath="IW4", polarisation="VV")
@@ -0,0 +1,118 @@
+import json
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from shapely.geometry import box
+
+from catalog import Catalog
+from download_data import pair_record
+from utils import setup_logging
+from watch import POLL_OVERLAP, HttpSearch, Scene, poll_once
+
+FOOTPRINT = {"type": "Polygon", "coordinates": [[[10, 45], [11, 45], [11, 46], [10, 46], [10, 45]]]}
+
+
+def feature(day, processed, orbit=95, frame=150):
+    start = f"2021-05-{day:02d}T17:39:41Z"
+    name = f"S1A_IW_SLC__1SDV_202105{day:02d}T173941_{orbit}_{frame}"
+    return {"type": "Feature", "geometry": FOOTPRINT,
+            "properties": {"sceneName": name, "fileName": name + ".zip", "startTime": start,
+                           "processingDate": processed, "pathNumber": orbit, "frameNumber": frame,
+                           "platform": "Sentinel-1A", "url": f"https://example.invalid/{name}.zip"}}
+
+
+def search_handler(features, queries):
+    """Stand-in for the ASF search API: filters by start/processingDate and records each query."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            queries.append(params)
+            orbits = {int(o) for o in params["relativeOrbit"].split(",")} if "relativeOrbit" in params else None
+            found = [f for f in features
+                     if (orbits is None or f["properties"]["pathNumber"] in orbits)
+                     and f["properties"]["processingDate"] >= params.get("processingDate", "")
+                     and f["properties"]["startTime"] >= params.get("start", "")]
+            body = json.dumps({"type": "FeatureCollection", "features": found}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/geo+json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog(str(tmp_path / "catalog.sqlite")) as c:
+        yield c
+
+
+def test_poll_plans_only_new_pairs(http_server, catalog):
+    features = [feature(day, "2021-05-20T00:00:00Z") for day in (1, 7, 13)]
+    features.append(feature(7, "2021-05-20T00:00:00Z", orbit=22))
+    queries = []
+    search = HttpSearch(http_server(search_handler(features, queries)))
+    logger = setup_logging("test_watch")
+    aoi = box(10.2, 45.2, 10.8, 45.8)
+
+    # Bootstrap: the best orbit is picked and every neighbouring pair is planned
+    planned = poll_once(catalog, search, "site", aoi, None, 1, "2021-05-01T00:00:00Z", logger)
+    assert planned == 2
+    assert catalog.get_state("site:orbits") == [95]
+    assert queries[0]["start"] == "2021-05-01T00:00:00Z"
+
+    # Nothing new: no pairs, and the orbit filter is now sent to the API
+    assert poll_once(catalog, search, "site", aoi, None, 1, "2021-05-01T00:00:00Z", logger) == 0
+    assert queries[1]["relativeOrbit"] == "95"
+
+    # A new acquisition is paired only with its nearest neighbour
+    features.append(feature(19, datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")))
+    assert poll_once(catalog, search, "site", aoi, None, 1, "2021-05-01T00:00:00Z", logger) == 1
+    assert catalog.pair_status(["P095_F150_20210513_20210519"]) == {"P095_F150_20210513_20210519": "planned"}
+
+    # A late scene between two known ones is paired with the closer of them only
+    features.append(feature(17, datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")))
+    assert poll_once(catalog, search, "site", aoi, None, 1, "2021-05-01T00:00:00Z", logger) == 1
+    assert catalog.pair_status(["P095_F150_20210517_20210519"]) == {"P095_F150_20210517_20210519": "planned"}
+
+
+def test_poll_marker_overlaps_previous_poll(http_server, catalog):
+    queries = []
+    search = HttpSearch(http_server(search_handler([feature(1, "2021-05-02T00:00:00Z")], queries)))
+    logger = setup_logging("test_watch")
+    before = datetime.utcnow()
+
+    poll_once(catalog, search, "site", box(10, 45, 11, 46), [95], 1, "2021-05-01T00:00:00Z", logger)
+    poll_once(catalog, search, "site", box(10, 45, 11, 46), [95], 1, "2021-05-01T00:00:00Z", logger)
+
+    marker = datetime.strptime(queries[1]["processingDate"], "%Y-%m-%dT%H:%M:%SZ")
+    # Late-indexed scenes processed shortly before the previous poll are still asked for
+    assert marker <= before - POLL_OVERLAP + timedelta(seconds=5)
+    assert len(catalog.known_scenes([feature(1, "")["properties"]["sceneName"]])) == 1
+
+
+def test_watch_acts_only_on_its_pairs(http_server, catalog):
+    features = [feature(day, "2021-05-20T00:00:00Z") for day in (1, 7)]
+    search = HttpSearch(http_server(search_handler(features, [])))
+    logger = setup_logging("test_watch")
+    poll_once(catalog, search, "site", box(10, 45, 11, 46), [95], 1, "2021-05-01T00:00:00Z", logger)
+
+    # Another run plans its own pair on other scenes in the same catalog
+    others = [Scene(f["properties"], f["geometry"]) for f in (feature(day, "") for day in (25, 31))]
+    catalog.add_scenes(others)
+    catalog.add_pairs([pair_record("P095_F150_20210525_20210531", others, ["other"])])
+
+    assert {r["scene_name"][17:25] for r in catalog.scenes_to_download(aoi="site")} == {"20210501", "20210507"}
+    assert len(catalog.scenes_to_download()) == 4
+
+    # Planning an existing pair for another AOI keeps the watch's tag
+    catalog.add_pairs([pair_record("P095_F150_20210501_20210507", [Scene(f["properties"]) for f in features], ["a1"])])
+    row = catalog.conn.execute("SELECT aois FROM pairs WHERE pair_id = 'P095_F150_20210501_20210507'").fetchone()
+    assert sorted(json.loads(row["aois"])) == ["a1", "site"]